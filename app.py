@@ -1,80 +1,427 @@
 import streamlit as st
-from utils.llm import analyze_prompt
-from utils.image_gen import generate_image
-from PIL import Image
-import io
+from utils.llm import (
+    analyze_prompt_stream,
+    warm_up,
+    CATEGORIES,
+    QUEUED,
+    EXAMPLE_PROMPTS,
+)
+from utils.image_gen import (
+    generate_images,
+    prompt_image_key,
+    edit_image_key,
+    TIERS,
+    DRAFT,
+    FINAL,
+    count_uncached_images,
+    plan_edit,
+    EDIT_COST,
+)
 import random
-from datetime import datetime
+import itertools
 import json
 import os
-import sqlite3
+import time
+import uuid
+import threading
+from utils.rate_limit import (
+    check_rate_limit,
+    get_remaining_generations,
+    check_user_quota,
+    refund_user_quota,
+    get_user_remaining,
+    get_user_wait,
+    user_quota_message,
+)
+from utils.image_store import image_store
+from utils.image_variants import (
+    image_variant,
+    stored_image_variant,
+    file_variant,
+    DISPLAY,
+    THUMBNAIL,
+    DEMO,
+)
+from utils.paths import ASSETS_DIR
+from utils.clients import breakers, limiters
+from utils.cache import suggestion_cache
+from utils.metrics import metrics, timer, start_metrics_server
+from utils.jobs import job_queue, DONE, FAILED
+from utils.events import log_event, ANALYZE, SELECT, GENERATE
 
 
-# Detect if running on HF Spaces and use persistent storage
-DB_PATH = "/data/rate_limits.db" if os.path.exists("/data") else "rate_limits.db"
+# Admins open the app with ?admin=<ADMIN_TOKEN> to see the performance panel
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Proxies in front of the app that append to X-Forwarded-For (1 on HF Spaces);
+# 0 ignores the header and keys quotas on the connection's IP
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
 
 
-def init_db():
-    """Initialize SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_limits
-        (date TEXT PRIMARY KEY, count INTEGER)
+@st.cache_resource
+def metrics_server():
+    """Prometheus /metrics endpoint on METRICS_PORT, started once per process"""
+    port = os.environ.get("METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+
+metrics_server()
+
+
+@st.cache_resource
+def demo_images():
+    """
+    Before/after demo images, resized and held in memory once per process so
+    the demo section does no disk reads or re-encoding per rerun.
+    """
+    return {
+        name: file_variant(os.path.join(ASSETS_DIR, f"{name}_image.png"), DEMO)
+        for name in ("before", "after")
+    }
+
+
+demo_images()
+
+# Upper bound on images rendered by one click in the variations grid
+MAX_BATCH_IMAGES = 8
+GRID_COLUMNS = 2
+
+# Past renders listed in each session's gallery; only their keys are kept
+HISTORY_MAX_ENTRIES = 24
+
+
+def build_variations(final_prompt, extra_options):
+    """
+    Expand the final prompt into every combination of its selections and the
+    extra options picked per category.
+    Returns: list of prompt dicts, the final prompt itself first
+    """
+    categories = list(final_prompt.keys())
+    choices = [
+        [final_prompt[cat]] + list(extra_options.get(cat, [])) for cat in categories
+    ]
+    return [dict(zip(categories, combo)) for combo in itertools.product(*choices)]
+
+
+def describe_variation(final_prompt, prompt_dict):
+    """Short caption listing where a variation differs from the final prompt"""
+    changes = [
+        f"{cat}: {value}"
+        for cat, value in prompt_dict.items()
+        if value != final_prompt.get(cat)
+    ]
+    return " · ".join(changes) if changes else "Final prompt"
+
+
+def client_id():
     """
+    Key for this visitor's quota: the address our trusted proxies saw (as on
+    HF Spaces), else the connection's IP, else this session. Entries left of
+    those the proxies appended come from the client and are ignored.
+    """
+    if "client_id" not in st.session_state:
+        forwarded = [
+            entry.strip()
+            for entry in st.context.headers.get("X-Forwarded-For", "").split(",")
+            if entry.strip()
+        ]
+        ip = None
+        if TRUSTED_PROXY_HOPS and len(forwarded) >= TRUSTED_PROXY_HOPS:
+            ip = forwarded[-TRUSTED_PROXY_HOPS]
+        ip = ip or st.context.ip_address
+        st.session_state.client_id = (
+            f"ip:{ip}" if ip else f"session:{uuid.uuid4().hex}"
+        )
+    return st.session_state.client_id
+
+
+def session_id():
+    """Anonymous id tying one session's analytics events together"""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+
+def log_generation(tier, prompt_dict, generation_time, cached, edited=False):
+    log_event(
+        GENERATE,
+        session=session_id(),
+        prompt=st.session_state.get("user_prompt"),
+        tier=tier,
+        seconds=generation_time,
+        cached=cached,
+        edited=edited,
+        data=prompt_dict,
     )
-    conn.commit()
-    conn.close()
 
 
-#
+def store_result(tier, prompt_dict, key, generation_time, cached, edited=False):
+    """
+    Keep a finished render's image store key in session state so it persists
+    after rerun; the image itself stays in the store.
+    """
+    log_generation(tier, prompt_dict, generation_time, cached, edited)
+    remaining, used, max_count = get_remaining_generations()
 
+    if tier == DRAFT:
+        st.session_state.draft_image_key = key
+        st.session_state.draft_prompt = prompt_dict
+    else:
+        st.session_state.generated_image_key = key
+        st.session_state.generated_prompt = prompt_dict
+        st.session_state.generation_time = generation_time
+        st.session_state.generation_cached = cached
+
+    add_to_history(key, tier, prompt_dict)
+    st.session_state.generation_count_display = f"{used:g}/{max_count}"
+    st.session_state.pop("generated_images", None)
+
+
+def add_to_history(key, tier, prompt_dict, caption=None):
+    """Remember a render for this session's gallery, newest first"""
+    history = [
+        entry for entry in st.session_state.get("history", []) if entry["key"] != key
+    ]
+    history.insert(
+        0,
+        {
+            "key": key,
+            "tier": tier,
+            "caption": caption or prompt_dict.get("subject", ""),
+        },
+    )
+    st.session_state.history = history[:HISTORY_MAX_ENTRIES]
+
+
+def png_download(key):
+    """Read the lossless PNG only when the download button is clicked"""
+    return lambda: image_store.get(key) or b""
+
+
+def image_grid(images, key_prefix):
+    """Thumbnails with PNG download buttons for a list of (caption, key)"""
+    columns = st.columns(GRID_COLUMNS)
+    for i, (caption, key) in enumerate(images):
+        with columns[i % GRID_COLUMNS]:
+            thumbnail = stored_image_variant(key, THUMBNAIL)
+            if thumbnail is None or not image_store.contains(key):
+                st.caption(f"{caption} (expired from storage)")
+                continue
+            st.image(thumbnail, caption=caption)
+            st.download_button(
+                label="Download",
+                data=png_download(key),
+                file_name=f"generated_image_{i + 1}.png",
+                mime="image/png",
+                key=f"{key_prefix}_{i}",
+            )
 
-def check_rate_limit():
-    """Check if user has exceeded daily rate limit"""
-    init_db()
-    max_generations = 15
-    today = datetime.now().date().isoformat()
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+def start_generation(prompt_dict, tier, allow_edit=True):
+    """
+    Serve a render from the image store or queue a background job for it.
+    allow_edit=False always renders prompt_dict from scratch, e.g. when
+    finalizing a draft, which must match the draft's prompt exactly.
+    """
+    # Already rendered images are served from the store and not charged.
+    # Edits are stored under their own keys, so this is always a true render.
+    key = prompt_image_key(prompt_dict, tier)
+
+    if image_store.contains(key):
+        store_result(tier, prompt_dict, key, 0.0, cached=True)
+        st.rerun()
+
+    # A final render that only changes a category or two edits the last one
+    edit = None
+    if tier == FINAL and allow_edit:
+        edit = plan_edit(
+            st.session_state.get("generated_prompt"),
+            st.session_state.get("generated_image_key"),
+            prompt_dict,
+        )
+    if edit:
+        # The same edit of the same image, made earlier
+        edit_key = edit_image_key(prompt_dict, edit)
+        if image_store.contains(edit_key):
+            store_result(tier, prompt_dict, edit_key, 0.0, cached=True, edited=True)
+            st.rerun()
+    cost = EDIT_COST if edit else TIERS[tier]["cost"]
+
+    remaining, current_count, max_count = get_remaining_generations()
+    user_wait = get_user_wait(client_id(), cost)
+
+    if user_wait != 0:
+        st.error(f"⛔ {user_quota_message(user_wait)}")
+    elif remaining < cost:
+        st.error(
+            f"⛔ Daily limit reached! You've used all {max_count} generations today. Please try again tomorrow."
+        )
+    else:
+        # Generation runs in the background; it is charged when a worker starts it
+        st.session_state.job_id = job_queue.submit(
+            prompt_dict, tier, client_id(), edit
+        )
+        st.rerun()
+
+
+@st.fragment(run_every=1)
+def job_status_panel():
+    """Poll the background generation job and pick up its result when done"""
+    job = job_queue.get(st.session_state.job_id)
+
+    if job is None:
+        del st.session_state.job_id
+        return
+
+    if job["status"] == DONE and image_store.contains(job["image_key"]):
+        store_result(
+            job["tier"],
+            job["prompt"],
+            job["image_key"],
+            job["generation_time"],
+            cached=False,
+            edited=job["edited"],
+        )
+        del st.session_state.job_id
+        st.rerun()
 
-    c.execute("SELECT count FROM daily_limits WHERE date = ?", (today,))
-    result = c.fetchone()
-    current_count = result[0] if result else 0
+    elif job["status"] in (DONE, FAILED):
+        st.error(f"⛔ {job['error'] or 'Failed to generate image. Please try again.'}")
+        if st.button("Retry"):
+            job_queue.retry(st.session_state.job_id)
+            st.rerun(scope="fragment")
 
-    if current_count >= max_generations:
-        conn.close()
-        return False, current_count, max_generations
+    elif job["queue_position"]:
+        st.info(
+            f"⏳ Lots of requests right now, you're #{job['queue_position']} in line..."
+        )
 
-    if result:
-        c.execute("UPDATE daily_limits SET count = count + 1 WHERE date = ?", (today,))
     else:
-        c.execute("INSERT INTO daily_limits VALUES (?, 1)", (today,))
+        if job["tier"] == DRAFT:
+            st.info("📝 Rendering a quick draft...")
+        elif job["edited"]:
+            st.info("🖌️ Editing your last image with the new choices...")
+        else:
+            st.info("🎨 Generating your image... This may take 10-30 seconds.")
+        # Show progressively refined previews while the image renders
+        if job["preview"]:
+            st.image(
+                image_variant(job["preview"], THUMBNAIL, persist=False),
+                caption="Preview",
+            )
+
+
+def start_analysis(prompt):
+    """
+    Stream suggestions into session state on a background thread, so each
+    category can be picked while the rest are still arriving.
+    Returns: the analysis dict the thread fills in
+    """
+    analysis = {
+        "suggestions": {},
+        "done": False,
+        "failed": False,
+        "queue_position": None,
+    }
+    session = session_id()
+    start = time.time()
+
+    def consume():
+        try:
+            for category, options in analyze_prompt_stream(prompt):
+                if category is None:
+                    analysis["failed"] = True
+                elif category == QUEUED:
+                    analysis["queue_position"] = options
+                else:
+                    analysis["queue_position"] = None
+                    analysis["suggestions"][category] = options
+        except Exception as e:
+            print(f"Error streaming suggestions: {e}")
+            analysis["failed"] = True
+        finally:
+            analysis["done"] = True
+            log_event(
+                ANALYZE,
+                session=session,
+                prompt=prompt,
+                seconds=time.time() - start,
+                ok=not analysis["failed"],
+                data=analysis["suggestions"],
+            )
 
-    conn.commit()
-    conn.close()
+    threading.Thread(target=consume, daemon=True).start()
 
-    return True, current_count + 1, max_generations
+    # Store suggestions in session state; the dict fills in as categories arrive
+    st.session_state.analysis = analysis
+    st.session_state.suggestions = analysis["suggestions"]
+    st.session_state.user_prompt = prompt
+    st.session_state.final_prompt = None
+    return analysis
 
 
-def get_remaining_generations():
-    """Get remaining generations for display"""
-    init_db()
-    max_generations = 15
-    today = datetime.now().date().isoformat()
+@st.fragment(run_every=0.25)
+def analysis_progress(shown):
+    """Rerun the app whenever another category's suggestions arrive"""
+    analysis = st.session_state.analysis
+    if analysis["done"] or len(analysis["suggestions"]) > shown:
+        st.rerun()
+    st.caption(f"⏳ Loading more suggestions... ({shown}/{len(CATEGORIES)})")
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
 
-    c.execute("SELECT count FROM daily_limits WHERE date = ?", (today,))
-    result = c.fetchone()
-    used = result[0] if result else 0
+@st.fragment
+def sidebar_stats():
+    """
+    Daily and per-client quotas, upstream health and the admin panel. Runs
+    on full reruns only, so interactions elsewhere on the page do not re-read
+    the rate limit database.
+    """
+    remaining, used, total = get_remaining_generations()
+    st.metric("Global Daily Generations Remaining", f"{remaining:g}/{total}")
+    # The quota refills continuously; show it in whole draft-sized steps
+    user_remaining, user_capacity = get_user_remaining(client_id())
+    st.metric(
+        "Your Generations Remaining",
+        f"{int(user_remaining * 4) / 4:g}/{user_capacity:g}",
+    )
 
-    conn.close()
+    if remaining <= 3 and remaining > 0:
+        st.warning("⚠️ Running low!")
+    elif remaining == 0:
+        st.error("❌ Limit reached for today")
 
-    return max_generations - used, used, max_generations
+    if any(breaker.state() != "closed" for breaker in breakers.values()):
+        st.warning("⚠️ OpenAI is having trouble right now. Please try again shortly.")
+
+    if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+        with st.expander("📈 Performance (admin)"):
+            st.dataframe(
+                [
+                    {
+                        "stage": stage,
+                        "count": stats["count"],
+                        "p50 ms": stats["p50"] * 1000,
+                        "p95 ms": stats["p95"] * 1000,
+                        "p99 ms": stats["p99"] * 1000,
+                    }
+                    for stage, stats in metrics.percentiles().items()
+                ]
+            )
+            st.json(
+                {
+                    "counters": metrics.counters(),
+                    "cache": suggestion_cache.stats(),
+                    "upstream": {
+                        endpoint: limiter.status()
+                        for endpoint, limiter in limiters.items()
+                    },
+                }
+            )
+            st.download_button(
+                label="Prometheus metrics",
+                data=metrics.prometheus_text(),
+                file_name="metrics.prom",
+                mime="text/plain",
+            )
 
 
 st.markdown(
@@ -223,13 +570,7 @@ with st.sidebar:
     st.title("🎨 Image Prompt Optimizer")
     st.markdown("---")
 
-    remaining, used, total = get_remaining_generations()
-    st.metric("Global Daily Generations Remaining", f"{remaining}/{total}")
-
-    if remaining <= 3 and remaining > 0:
-        st.warning("⚠️ Running low!")
-    elif remaining == 0:
-        st.error("❌ Limit reached for today")
+    sidebar_stats()
 
     st.markdown("---")
 
@@ -257,39 +598,42 @@ with st.sidebar:
 # ________________________
 
 # Visual demo section
-st.subheader("✨ See the Difference")
-
-col1, col2, col3 = st.columns([1, 0.3, 1])
+@st.fragment
+def demo_section():
+    """Static before/after example, isolated from the rest of the page"""
+    st.subheader("✨ See the Difference")
+
+    col1, col2, col3 = st.columns([1, 0.3, 1])
+
+    with col1:
+        st.markdown("### Before")
+        st.markdown("**Simple prompt:**")
+        st.code("dog in a field", language=None)
+        st.image(demo_images()["before"], caption="Generic result")
+
+    with col2:
+        st.markdown(
+            "<div style='text-align: center; font-size: 3rem; margin-top: 100px;'>→</div>",
+            unsafe_allow_html=True,
+        )
 
-with col1:
-    st.markdown("### Before")
-    st.markdown("**Simple prompt:**")
-    st.code("dog in a field", language=None)
-    st.image("src/assets/before_image.png", caption="Generic result")
+    with col3:
+        st.markdown("### After")
+        st.markdown("**Enhanced with our tool:**")
+        with st.expander("View detailed prompt", expanded=False):
+            st.json(
+                {
+                    "subject": "Golden retriever running joyfully",
+                    "setting": "Sunlit meadow with wildflowers",
+                    "style": "Photorealistic, high detail, natural colors",
+                    "lighting": "Golden hour warm glow",
+                    "details": "Butterflies, distant mountains, soft grass",
+                }
+            )
+        st.image(demo_images()["after"], caption="Professional result")
 
-with col2:
-    st.markdown(
-        "<div style='text-align: center; font-size: 3rem; margin-top: 100px;'>→</div>",
-        unsafe_allow_html=True,
-    )
 
-with col3:
-    st.markdown("### After")
-    st.markdown("**Enhanced with our tool:**")
-    with st.expander("View detailed prompt", expanded=False):
-        st.json(
-            {
-                "subject": "Golden retriever running joyfully",
-                "setting": "Sunlit meadow with wildflowers",
-                "style": "Photorealistic, high detail, natural colors",
-                "lighting": "Golden hour warm glow",
-                "details": "Butterflies, distant mountains, soft grass",
-            }
-        )
-    st.image(
-        "src/assets/after_image.png",
-        caption="Professional result",
-    )
+demo_section()
 
 
 st.markdown("---")
@@ -301,21 +645,8 @@ st.markdown(
 # ________________________
 
 
-placeholder_examples = [
-    "golden retriever playing in snow",
-    "photographer capturing sunset over mountains",
-    "woman walking through cyberpunk city street",
-    "barista working in cozy coffee shop interior",
-    "astronaut riding a horse on alien planet",
-    "deer standing in magical forest with glowing mushrooms",
-    "couple driving vintage car on desert highway",
-    "monk meditating in zen garden with koi pond",
-    "pilot navigating steampunk airship through clouds",
-    "child watching cat reading a book",
-]
-
 if "placeholder_text" not in st.session_state:
-    st.session_state.placeholder_text = random.choice(placeholder_examples)
+    st.session_state.placeholder_text = random.choice(EXAMPLE_PROMPTS)
 
 # Step 1: User input
 prompt = st.text_input(
@@ -325,22 +656,37 @@ prompt = st.text_input(
 if st.button("Analyze Prompt"):
     if prompt:
         with st.spinner("Analyzing your prompt..."):
-            suggestions = analyze_prompt(prompt)
-
-            if suggestions:
-                st.success("✅ Analysis complete!")
-
-                # Store suggestions in session state
-                st.session_state.suggestions = suggestions
-                st.session_state.user_prompt = prompt
-                st.session_state.final_prompt = None
-            else:
-                st.error("Failed to analyze prompt. Please try again.")
+            analysis = start_analysis(prompt)
+            # Wait for the first category so it renders on this run
+            queue_status = st.empty()
+            while not analysis["suggestions"] and not analysis["done"]:
+                if analysis["queue_position"]:
+                    queue_status.caption(
+                        f"⏳ Lots of requests right now, you're "
+                        f"#{analysis['queue_position']} in line..."
+                    )
+                time.sleep(0.05)
+            queue_status.empty()
     else:
         st.warning("Please enter a prompt first!")
 
+if "analysis" in st.session_state and st.session_state.analysis["done"]:
+    analysis = st.session_state.pop("analysis")
+    if analysis["failed"]:
+        st.session_state.pop("suggestions", None)
+        st.error("Failed to analyze prompt. Please try again.")
+    else:
+        st.success("✅ Analysis complete!")
+
+
 # Step 2: Display suggestions with custom option
-if "suggestions" in st.session_state:
+@st.fragment
+def selection_form():
+    """
+    Steps 2 and 3: pick an option per category and build the final prompt.
+    Picking an option reruns only this fragment; building the prompt reruns
+    the app so the result panel shows up.
+    """
     st.divider()
     st.subheader("Choose options for your image:")
 
@@ -348,6 +694,7 @@ if "suggestions" in st.session_state:
     selections = {}
 
     categories = list(suggestions.keys())
+    scroll_to = None
 
     # Display each category
     for idx, category in enumerate(categories):
@@ -390,33 +737,39 @@ if "suggestions" in st.session_state:
         else:
             selections[category] = selected
 
-        # Store the selection and trigger scroll to next category
+        # Store the selection and scroll to the next category once the loop ends
         if selected and selected != st.session_state.get(f"selection_{category}"):
             st.session_state[f"selection_{category}"] = selected
-
-            # Scroll to next category if there is one
             if idx < len(categories) - 1:
-                next_category = categories[idx + 1]
-                st.components.v1.html(
-                    f"""
-                    <script>
-                        setTimeout(function() {{
-                            const element = window.parent.document.getElementById('category-{next_category}');
-                            if (element) {{
-                                element.scrollIntoView({{
-                                    behavior: 'smooth',
-                                    block: 'center'
-                                }});
-                            }}
-                        }}, 100);
-                    </script>
-                """,
-                    height=0,
-                )
+                scroll_to = categories[idx + 1]
+
+    # One zero-height script after the last category, so the script iframe
+    # does not shift the categories below the one just picked
+    if scroll_to:
+        st.components.v1.html(
+            f"""
+            <script>
+                setTimeout(function() {{
+                    const element = window.parent.document.getElementById('category-{scroll_to}');
+                    if (element) {{
+                        element.scrollIntoView({{
+                            behavior: 'smooth',
+                            block: 'center'
+                        }});
+                    }}
+                }}, 100);
+            </script>
+        """,
+            height=0,
+        )
+
+    streaming = "analysis" in st.session_state
+    if streaming:
+        analysis_progress(len(categories))
 
     # Step 3: Build final prompt button
     st.divider()
-    if st.button("Build Final Prompt"):
+    if st.button("Build Final Prompt", disabled=streaming):
         # Check if all categories have actual selections
         categories = list(suggestions.keys())
         missing_selections = [
@@ -433,52 +786,221 @@ if "suggestions" in st.session_state:
         elif has_empty_custom:
             st.warning("Please fill in all custom fields or select a different option.")
         else:
+            for category, value in selections.items():
+                custom = value not in suggestions[category]
+                log_event(
+                    SELECT,
+                    session=session_id(),
+                    prompt=st.session_state.get("user_prompt"),
+                    category=category,
+                    option=value,
+                    rank=None if custom else suggestions[category].index(value),
+                    custom=custom,
+                )
             st.session_state.final_prompt = selections
-            st.success("✅ Prompt built!")
+            st.session_state.prompt_built = True
+            # The result panel lives outside this fragment
+            st.rerun()
+
+
+if "suggestions" in st.session_state:
+    selection_form()
+
 
 # Step 4: Display final prompt JSON and generate image
-if "final_prompt" in st.session_state and st.session_state.final_prompt:
+@st.fragment
+def result_panel():
+    """
+    Step 4: the final prompt, generation controls and results. Variation
+    picks and downloads rerun only this fragment.
+    """
     st.divider()
+    if st.session_state.pop("prompt_built", False):
+        st.success("✅ Prompt built!")
     st.subheader("Your Final Prompt:")
     st.json(st.session_state.final_prompt)
 
-    if st.button("Generate Image"):
-        can_generate, current_count, max_count = check_rate_limit()
+    with st.expander("🎲 Variations", expanded=False):
+        st.write("Pick extra options to render every combination side by side.")
+        extra_options = {}
+        for category, options in st.session_state.suggestions.items():
+            extra_options[category] = st.multiselect(
+                f"Extra {category} options:",
+                [
+                    o
+                    for o in options
+                    if o != st.session_state.final_prompt.get(category)
+                ],
+                key=f"vary_{category}",
+            )
+        n_per_prompt = st.number_input(
+            "Images per combination", min_value=1, max_value=4, value=1
+        )
+
+    prompt_dicts = build_variations(st.session_state.final_prompt, extra_options)
+    total_images = len(prompt_dicts) * n_per_prompt
+
+    if total_images > MAX_BATCH_IMAGES:
+        st.warning(
+            f"That is {total_images} images. Please pick at most {MAX_BATCH_IMAGES}."
+        )
+    elif total_images > 1 and st.button(f"Generate {total_images} Images"):
+        # Only images that are not in the store are charged, one generation each
+        to_render = count_uncached_images(prompt_dicts, n_per_prompt)
+
+        user_allowed, user_wait = True, 0
+        if to_render:
+            # The client's own quota first, then the global limit as the outer bound
+            user_allowed, user_wait = check_user_quota(client_id(), to_render)
+        if user_allowed and to_render:
+            can_generate, current_count, max_count = check_rate_limit(to_render)
+            if not can_generate:
+                refund_user_quota(client_id(), to_render)
+        else:
+            remaining, current_count, max_count = get_remaining_generations()
+            can_generate = user_allowed
 
-        if not can_generate:
+        if not user_allowed:
+            st.error(f"⛔ {user_quota_message(user_wait)}")
+        elif not can_generate:
             st.error(
-                f"⛔ Daily limit reached! You've used all {max_count} generations today. Please try again tomorrow."
+                f"⛔ Not enough generations left today for {to_render} images "
+                f"({current_count:g}/{max_count} used)."
             )
         else:
-            with st.spinner("Generating your image... This may take 10-30 seconds."):
-                image_bytes, gen_time = generate_image(st.session_state.final_prompt)
-
-                if image_bytes:
-                    # Store in session state so it persists after rerun
-                    st.session_state.generated_image = image_bytes
-                    st.session_state.generation_time = gen_time
-                    st.session_state.generation_count_display = (
-                        f"{current_count}/{max_count}"
+            with st.spinner(f"Generating {total_images} images..."):
+                columns = st.columns(GRID_COLUMNS)
+                placeholders = [
+                    columns[i % GRID_COLUMNS].empty() for i in range(total_images)
+                ]
+                batch_results = [None] * total_images
+
+                for idx, variant, image_bytes, gen_time in generate_images(
+                    prompt_dicts, n_per_prompt
+                ):
+                    slot = idx * n_per_prompt + variant
+                    caption = describe_variation(
+                        st.session_state.final_prompt, prompt_dicts[idx]
                     )
-                    st.rerun()  # ADD THIS LINE
+                    if image_bytes:
+                        key = prompt_image_key(prompt_dicts[idx], FINAL, variant)
+                        placeholders[slot].image(
+                            stored_image_variant(key, THUMBNAIL), caption=caption
+                        )
+                        batch_results[slot] = (caption, key)
+                        add_to_history(key, FINAL, prompt_dicts[idx], caption)
+                        # Cached images come back with no generation time
+                        log_generation(
+                            FINAL, prompt_dicts[idx], gen_time, cached=gen_time == 0
+                        )
+                    else:
+                        placeholders[slot].error("Failed to generate this image.")
+
+            st.session_state.generated_images = [r for r in batch_results if r]
+            st.session_state.generation_count_display = (
+                f"{current_count:g}/{max_count}"
+            )
+            st.session_state.pop("generated_image_key", None)
+            st.rerun()
+
+    if total_images == 1:
+        draft_col, final_col = st.columns(2)
+        with draft_col:
+            if st.button("Quick Draft"):
+                start_generation(st.session_state.final_prompt, DRAFT)
+        with final_col:
+            if st.button("Generate Image"):
+                start_generation(st.session_state.final_prompt, FINAL)
+
+    if "job_id" in st.session_state:
+        job_status_panel()
+
+    # Display draft and final images side by side if they exist in session state
+    if (
+        "generated_image_key" in st.session_state
+        or "draft_image_key" in st.session_state
+    ):
+        st.info(
+            f"📊 Generations used today: {st.session_state.generation_count_display}"
+        )
+
+        if "draft_image_key" in st.session_state:
+            draft_col, final_col = st.columns(2)
+            with draft_col:
+                draft = stored_image_variant(
+                    st.session_state.draft_image_key, THUMBNAIL
+                )
+                if draft:
+                    st.image(draft, caption="Draft")
                 else:
-                    st.error("Failed to generate image. Please try again.")
+                    st.caption("This draft has expired from storage.")
+                if st.button("✨ Finalize"):
+                    start_generation(
+                        st.session_state.draft_prompt, FINAL, allow_edit=False
+                    )
+        else:
+            final_col = st.container()
 
-    # Display generated image if it exists in session state
-    if "generated_image" in st.session_state:
-        image = Image.open(io.BytesIO(st.session_state.generated_image))
+        with final_col:
+            if "generated_image_key" in st.session_state:
+                key = st.session_state.generated_image_key
+                if st.session_state.get("generation_cached"):
+                    st.success("✅ Image loaded from cache!")
+                else:
+                    st.success(
+                        f"✅ Image generated in {st.session_state.generation_time:.2f} seconds!"
+                    )
+                # Show the compact JPEG; the lossless PNG is only for download
+                with timer("app.image_display"):
+                    image = stored_image_variant(key, DISPLAY)
+                    if image:
+                        st.image(image, caption="Your Generated Image")
+
+                if image and image_store.contains(key):
+                    st.download_button(
+                        label="Download Image",
+                        data=png_download(key),
+                        file_name="generated_image.png",
+                        mime="image/png",
+                    )
+                else:
+                    st.caption("This image has expired from storage.")
+            else:
+                st.caption("Finalize the draft to render it at full quality.")
 
-        st.success(
-            f"✅ Image generated in {st.session_state.generation_time:.2f} seconds!"
-        )
+    # Display a generated variations grid if it exists in session state
+    if "generated_images" in st.session_state:
+        st.success(f"✅ {len(st.session_state.generated_images)} images generated!")
         st.info(
             f"📊 Generations used today: {st.session_state.generation_count_display}"
         )
-        st.image(image, caption="Your Generated Image")
 
-        st.download_button(
-            label="Download Image",
-            data=st.session_state.generated_image,
-            file_name="generated_image.png",
-            mime="image/png",
+        image_grid(st.session_state.generated_images, "download")
+
+
+if "final_prompt" in st.session_state and st.session_state.final_prompt:
+    result_panel()
+
+# Gallery of this session's past renders, served from the shared image store
+if st.session_state.get("history"):
+    st.divider()
+    with st.expander(f"🕘 Your history ({len(st.session_state.history)})"):
+        image_grid(
+            [(entry["caption"], entry["key"]) for entry in st.session_state.history],
+            "history",
         )
+
+
+@st.cache_resource
+def background_warm_up():
+    """
+    Once per process, after the first page is out: build the OpenAI client
+    and load the similarity index on a background thread, while the first
+    visitor is still typing.
+    """
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+background_warm_up()
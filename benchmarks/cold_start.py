@@ -0,0 +1,135 @@
+"""
+Cold start: how long a fresh server process takes to import the app's
+modules, paint the page for its first visitor and answer that visitor's
+first prompt.
+
+Run: python -m benchmarks.cold_start [--runs 5] [--think-seconds 1] [--persistent-data]
+
+Every run is a new process against the local mock OpenAI server, in a new
+working directory like a Space waking up without persistent storage, or
+with --persistent-data in one directory kept (and primed) across runs. The
+first prompt is sent --think-seconds after the first paint, the time a
+visitor takes to type it.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+
+STEPS = ("import_streamlit", "import_app", "first_script_run", "first_paint", "first_option")
+
+
+def app_modules():
+    """The utils modules app.py imports, in order"""
+    with open(APP_PATH, encoding="utf-8") as f:
+        return re.findall(r"^from (utils\.\w+) import", f.read(), re.MULTILINE)
+
+
+def cold_run(think_seconds, timeout, data_dir=None):
+    """
+    One cold process: import, first script run, first analysis.
+    Returns: {step: seconds}
+    """
+    os.chdir(data_dir or tempfile.mkdtemp(prefix="cold_start_"))
+    sys.path.insert(0, REPO_ROOT)
+    timings = {}
+
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    timings["import_streamlit"] = time.perf_counter() - start
+
+    # What the first script run imports before it can draw anything
+    step = time.perf_counter()
+    for module in app_modules():
+        importlib.import_module(module)
+    timings["import_app"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    timings["first_script_run"] = time.perf_counter() - step
+    timings["first_paint"] = timings["import_app"] + timings["first_script_run"]
+
+    time.sleep(think_seconds)
+    at.text_input[0].input("golden retriever playing in snow").run()
+    step = time.perf_counter()
+    next(b for b in at.button if b.label == "Analyze Prompt").click().run()
+    if not at.radio:
+        raise RuntimeError("no suggestions after the first analysis")
+    timings["first_option"] = time.perf_counter() - step
+
+    return timings
+
+
+def main():
+    from benchmarks.mock_openai import add_mock_arguments, config_from_args, serve_in_thread
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--think-seconds", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument(
+        "--persistent-data",
+        action="store_true",
+        help="share one data directory between runs, like /data on Spaces",
+    )
+    add_mock_arguments(parser)
+    # Upstream time would only add a constant to first_option
+    parser.set_defaults(chat_latency="0")
+    args = parser.parse_args()
+
+    server, base_url = serve_in_thread(config=config_from_args(args))
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "mock"
+
+    data_dir = tempfile.mkdtemp(prefix="cold_start_") if args.persistent_data else None
+
+    def run():
+        # A pool per run, so each run gets a process that has imported nothing
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            return pool.submit(
+                cold_run, args.think_seconds, args.timeout, data_dir
+            ).result()
+
+    if data_dir:
+        # Fill the data directory the way an earlier server process would have
+        run()
+    runs = [run() for _ in range(args.runs)]
+    server.shutdown()
+
+    def median(values):
+        return sorted(values)[len(values) // 2]
+
+    print(
+        json.dumps(
+            {
+                "runs": args.runs,
+                "ms_median": {
+                    step: 1000 * median([run[step] for run in runs]) for step in STEPS
+                },
+                "ms_max": {
+                    step: 1000 * max(run[step] for run in runs) for step in STEPS
+                },
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
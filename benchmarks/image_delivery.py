@@ -0,0 +1,101 @@
+"""
+Per-rerun cost of showing a generated image: decoding the PNG and letting
+st.image re-encode it (the old path) vs handing it a cached JPEG variant.
+
+Run: python -m benchmarks.image_delivery [--reruns 20]
+
+Uses st.image's own encoding step outside a running app, so the numbers
+are the server-side CPU per rerun and the bytes each rerun sends.
+"""
+
+import io
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+import streamlit.elements.lib.image_utils as image_utils
+from streamlit.elements.lib.image_utils import image_to_url
+from streamlit.elements.lib.layout_utils import LayoutConfig
+
+
+def sample_png(size=1024, seed=0):
+    """Photo-like test image: a gradient with fine noise, which PNG compresses poorly"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 180, size)[None, :, None]
+    pixels = (rng.random((size, size, 3)) * 60 + gradient).astype("uint8")
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def sent_bytes(image):
+    """Bytes st.image would serve for this image"""
+    captured = {}
+    original = image_utils._ensure_image_size_and_format
+
+    def capture(image_data, layout_config, image_format):
+        captured["data"] = original(image_data, layout_config, image_format)
+        return captured["data"]
+
+    image_utils._ensure_image_size_and_format = capture
+    try:
+        image_to_url(image, LayoutConfig(width="content"), False, "RGB", "auto", "x")
+    finally:
+        image_utils._ensure_image_size_and_format = original
+    return len(captured["data"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reruns", type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="image_delivery_"))
+    from utils.image_variants import image_variant, DISPLAY, THUMBNAIL
+
+    png = sample_png()
+    layout = LayoutConfig(width="content")
+
+    def old_rerun():
+        image = Image.open(io.BytesIO(png))
+        image.load()
+        image_to_url(image, layout, False, "RGB", "auto", "x")
+
+    def new_rerun():
+        image_to_url(image_variant(png, DISPLAY), layout, False, "RGB", "auto", "x")
+
+    start = time.perf_counter()
+    image_variant(png, DISPLAY)
+    image_variant(png, THUMBNAIL)
+    first_encode = time.perf_counter() - start
+
+    results = {}
+    for name, rerun in (("png_decode_reencode", old_rerun), ("cached_variant", new_rerun)):
+        start = time.perf_counter()
+        for _ in range(args.reruns):
+            rerun()
+        results[name] = 1000 * (time.perf_counter() - start) / args.reruns
+
+    print(
+        json.dumps(
+            {
+                "png_bytes": len(png),
+                "sent_bytes": {
+                    "png_decode_reencode": sent_bytes(Image.open(io.BytesIO(png))),
+                    "display_variant": sent_bytes(image_variant(png, DISPLAY)),
+                    "thumbnail_variant": sent_bytes(image_variant(png, THUMBNAIL)),
+                },
+                "ms_per_rerun": results,
+                "first_encode_ms": 1000 * first_encode,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
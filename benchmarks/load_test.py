@@ -0,0 +1,204 @@
+"""
+Load test: N concurrent Streamlit sessions walk analyze → select → generate
+through app.py against the local mock OpenAI server.
+
+Run: python -m benchmarks.load_test --sessions 20 --output results.json
+
+AppTest swaps a process-global Runtime on every run, so concurrent sessions
+run in separate worker processes that share the data directory, the same
+way several server processes would share /data.
+
+Reports throughput, per-step p50/p99 latency, peak RSS and time spent in
+SQLite, and writes them as JSON tagged with the current commit so runs can
+be compared across commits.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from benchmarks.mock_openai import add_mock_arguments, config_from_args, serve_in_thread
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+
+STEPS = ("first_render", "first_option", "analyze", "select", "build", "generate", "total")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def click(at, label):
+    next(b for b in at.button if b.label == label).click().run()
+
+
+def run_session(index, args):
+    """
+    Drive one session through the whole flow in a worker process.
+    Returns: (timings, sqlite_samples, peak_rss_mb), or raises on failure
+    """
+    from streamlit.testing.v1 import AppTest
+    from utils.metrics import metrics
+
+    timings = {}
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+
+    start = step = time.perf_counter()
+    at.run()
+    timings["first_render"] = time.perf_counter() - step
+
+    prompt = args.prompt if args.shared_prompt else f"{args.prompt} #{index}"
+    at.text_input[0].input(prompt).run()
+
+    step = time.perf_counter()
+    click(at, "Analyze Prompt")
+    timings["first_option"] = time.perf_counter() - step
+    # Suggestions stream in; poll until every category has rendered
+    deadline = time.time() + args.timeout
+    while "analysis" in at.session_state:
+        if at.exception or time.time() > deadline:
+            raise RuntimeError(f"session {index} did not finish analyzing")
+        time.sleep(args.poll_interval)
+        at.run()
+    timings["analyze"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    for radio in at.radio:
+        radio.set_value(radio.options[0]).run()
+    timings["select"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    click(at, "Build Final Prompt")
+    timings["build"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    click(at, "Generate Image")
+    deadline = time.time() + args.timeout
+    while not any("Image" in s.value for s in at.success):
+        if at.exception or time.time() > deadline:
+            raise RuntimeError(f"session {index} did not finish generating")
+        time.sleep(args.poll_interval)
+        at.run()
+    timings["generate"] = time.perf_counter() - step
+
+    timings["total"] = time.perf_counter() - start
+
+    sqlite_samples = [
+        (stage, seconds) for _, stage, seconds in metrics.samples("rate_limit.")
+    ]
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return timings, sqlite_samples, peak_rss_mb
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent session load test")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--prompt", default="golden retriever playing in snow")
+    parser.add_argument(
+        "--shared-prompt",
+        action="store_true",
+        help="every session uses the same prompt (exercises caching)",
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--output", help="write JSON results to this file")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock_config = config_from_args(args)
+    server, base_url = serve_in_thread(config=mock_config)
+
+    # Fresh working directory so databases and images start cold, pointed at the mock
+    output = os.path.abspath(args.output) if args.output else None
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["DAILY_GENERATION_LIMIT"] = str(args.sessions * 10)
+    os.environ["USER_GENERATION_QUOTA"] = str(args.sessions * 10)
+    os.chdir(tempfile.mkdtemp(prefix="load_test_"))
+    sys.path.insert(0, REPO_ROOT)
+
+    results, failures, sqlite_samples, peak_rss = [], [], {}, []
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.concurrency or args.sessions,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        futures = [pool.submit(run_session, i, args) for i in range(args.sessions)]
+        for future in as_completed(futures):
+            try:
+                timings, samples, rss = future.result()
+            except Exception as e:
+                failures.append(f"{type(e).__name__}: {e}")
+                continue
+            results.append(timings)
+            peak_rss.append(rss)
+            for stage, seconds in samples:
+                sqlite_samples.setdefault(stage, []).append(seconds)
+    wall_seconds = time.perf_counter() - start
+
+    server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "sessions": args.sessions,
+        "completed": len(results),
+        "failures": failures,
+        "wall_seconds": wall_seconds,
+        "throughput_sessions_per_second": len(results) / wall_seconds,
+        "latency_seconds": {
+            step: {
+                "p50": percentile([r[step] for r in results], 0.5),
+                "p99": percentile([r[step] for r in results], 0.99),
+            }
+            for step in STEPS
+        },
+        "peak_rss_mb": {
+            "max_session_process": max(peak_rss, default=None),
+            "sum_session_processes": sum(peak_rss),
+        },
+        # Time spent in rate limiter SQLite calls; grows with lock contention
+        "sqlite_seconds": {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p99": percentile(values, 0.99),
+                "total": sum(values),
+            }
+            for stage, values in sorted(sqlite_samples.items())
+        },
+        "upstream_requests": mock_config.requests,
+    }
+
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
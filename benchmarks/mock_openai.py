@@ -0,0 +1,381 @@
+"""
+Local stand-in for the OpenAI endpoints the app uses, so the pipeline can be
+exercised without spending API credit.
+
+Run it:    python -m benchmarks.mock_openai --port 8000 --image-latency lognormal:8,0.4
+Point at:  OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock
+
+Latencies are "fixed:S", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA" in
+seconds; a bare number means fixed.
+"""
+
+import io
+import json
+import math
+import time
+import base64
+import random
+import argparse
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PIL import Image, ImageFilter
+
+MOCK_SUGGESTIONS = {
+    "subject": ["Golden retriever bounding through snow", "Puppy catching snowflakes"],
+    "setting": ["Snowy pine forest", "Quiet village street in winter"],
+    "style": ["Photorealistic, high detail, natural colors", "Watercolor illustration"],
+    "lighting": ["Soft overcast daylight", "Golden hour glow"],
+    "details": ["Falling snowflakes", "Footprints trailing behind"],
+}
+
+# Streamed chat responses are sent a few characters at a time, like real tokens
+CHAT_CHUNK_CHARS = 12
+
+
+@lru_cache(maxsize=64)
+def render_image(seed, size=1024, blur=0):
+    """Deterministic gradient PNG, blurred for earlier partial frames"""
+    red = Image.linear_gradient("L").resize((size, size))
+    green = red.rotate(90 * (seed % 4))
+    blue = Image.radial_gradient("L").resize((size, size))
+    image = Image.merge("RGB", (red, green, blue))
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(blur))
+
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def parse_latency(spec):
+    """
+    Turn a latency spec into a function returning seconds to wait.
+    Accepts a number or "fixed:S", "uniform:LOW,HIGH", "lognormal:MEDIAN,SIGMA".
+    """
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda: value
+
+    params = [float(p) for p in args.split(",")]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockConfig:
+    """Knobs shared by all request handlers of one server"""
+
+    def __init__(
+        self,
+        chat_latency=0.5,
+        image_latency=2.0,
+        image_size=256,
+        error_rate=0.0,
+        error_status=429,
+        capacity=0,
+    ):
+        self.chat_latency = parse_latency(chat_latency)
+        self.image_latency = parse_latency(image_latency)
+        self.image_size = image_size
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # Like a real rate limit: requests beyond this many in flight get a 429
+        self.capacity = capacity
+
+        self._lock = threading.Lock()
+        self.requests = {}  # (path, status) -> count
+        self.in_flight = 0
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+    def admit(self):
+        """Take an in-flight slot, or return False if over capacity"""
+        with self._lock:
+            if self.capacity and self.in_flight >= self.capacity:
+                return False
+            self.in_flight += 1
+            return True
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count(self, path, status):
+        with self._lock:
+            key = f"{path} {status}"
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        # Image edits upload the image as multipart form data; nothing in it
+        # changes the mock's response
+        if not self.headers.get("Content-Type", "").startswith("multipart/"):
+            body = json.loads(body or b"{}")
+
+        if self.config.should_fail():
+            self._error(self.config.error_status)
+        elif not self.config.admit():
+            self._error(429)
+        else:
+            try:
+                self._route(body)
+            finally:
+                self.config.finish()
+
+    def _route(self, body):
+        if self.path.endswith("/chat/completions"):
+            if body.get("stream"):
+                self._chat_stream(body)
+            else:
+                self._chat_completion(body)
+        elif self.path.endswith("/images/generations"):
+            if body.get("stream"):
+                self._image_stream(body)
+            else:
+                self._image_generation(body)
+        elif self.path.endswith("/images/edits"):
+            self._image_edit()
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _send_json(self, status, payload, headers=None):
+        self.config.count(self.path, status)
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status):
+        message = "Rate limit exceeded" if status == 429 else "Upstream overloaded"
+        self._send_json(
+            status,
+            {"error": {"message": message, "type": "mock_error", "code": status}},
+            headers={"Retry-After": "1"} if status == 429 else None,
+        )
+
+    def _chat_completion(self, body):
+        time.sleep(self.config.chat_latency())
+        self._send_json(
+            200,
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": json.dumps(MOCK_SUGGESTIONS),
+                        },
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 400,
+                    "completion_tokens": 200,
+                    "total_tokens": 600,
+                },
+            },
+        )
+
+    def _chat_stream(self, body):
+        """Server-sent events: the suggestions JSON in small chunks spread over the latency"""
+        self.config.count(self.path, 200)
+        content = json.dumps(MOCK_SUGGESTIONS)
+        pieces = [
+            content[i : i + CHAT_CHUNK_CHARS]
+            for i in range(0, len(content), CHAT_CHUNK_CHARS)
+        ]
+        latency = self.config.chat_latency()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def chunk(choices, usage=None):
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": choices,
+                "usage": usage,
+            }
+
+        events = [
+            chunk([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            for piece in pieces
+        ]
+        events.append(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append(
+                chunk(
+                    [],
+                    {"prompt_tokens": 400, "completion_tokens": 200, "total_tokens": 600},
+                )
+            )
+
+        for event in events:
+            time.sleep(latency / len(events))
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _image_edit(self):
+        time.sleep(self.config.image_latency())
+        self._send_json(
+            200,
+            {
+                "created": int(time.time()),
+                "data": [
+                    {
+                        "b64_json": base64.b64encode(
+                            render_image(1, self.config.image_size)
+                        ).decode("ascii")
+                    }
+                ],
+            },
+        )
+
+    def _image_generation(self, body):
+        time.sleep(self.config.image_latency())
+        n = body.get("n", 1)
+        self._send_json(
+            200,
+            {
+                "created": int(time.time()),
+                "data": [
+                    {
+                        "b64_json": base64.b64encode(
+                            render_image(i, self.config.image_size)
+                        ).decode("ascii")
+                    }
+                    for i in range(n)
+                ],
+            },
+        )
+
+    def _image_stream(self, body):
+        """Server-sent events: partial frames spread over the latency, then the final image"""
+        self.config.count(self.path, 200)
+        partial_images = body.get("partial_images", 0) or 0
+        frames = partial_images + 1
+        latency = self.config.image_latency()
+        common = {
+            "background": "opaque",
+            "output_format": "png",
+            "quality": body.get("quality", "medium"),
+            "size": body.get("size", "1024x1024"),
+        }
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        for index in range(frames):
+            time.sleep(latency / frames)
+            final = index == frames - 1
+            blur = 0 if final else 8 * (partial_images - index)
+            event = dict(
+                common,
+                b64_json=base64.b64encode(
+                    render_image(0, self.config.image_size, blur=blur)
+                ).decode("ascii"),
+                created_at=int(time.time()),
+            )
+            if final:
+                event["type"] = "image_generation.completed"
+                event["usage"] = {
+                    "input_tokens": 50,
+                    "input_tokens_details": {"image_tokens": 0, "text_tokens": 50},
+                    "output_tokens": 1000,
+                    "total_tokens": 1050,
+                }
+            else:
+                event["type"] = "image_generation.partial_image"
+                event["partial_image_index"] = index
+
+            self.wfile.write(
+                f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8")
+            )
+            self.wfile.flush()
+
+
+def serve_in_thread(port=0, config=None):
+    """
+    Start a mock server on a daemon thread.
+    Returns: (server, base_url) — call server.shutdown() when done
+    """
+    handler = type(
+        "ConfiguredHandler", (MockOpenAIHandler,), {"config": config or MockConfig()}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def add_mock_arguments(parser):
+    """Mock server options shared by the benchmark scripts"""
+    parser.add_argument("--chat-latency", default="0.5")
+    parser.add_argument("--image-latency", default="2.0")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument(
+        "--capacity", type=int, default=0, help="429 beyond this many requests in flight"
+    )
+
+
+def config_from_args(args):
+    return MockConfig(
+        chat_latency=args.chat_latency,
+        image_latency=args.image_latency,
+        image_size=args.image_size,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        capacity=args.capacity,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI server")
+    parser.add_argument("--port", type=int, default=8000)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = serve_in_thread(args.port, config_from_args(args))
+    print(f"Mock OpenAI listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
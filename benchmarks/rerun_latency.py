@@ -0,0 +1,155 @@
+"""
+Rerun latency of a category pick: the whole script rerunning (what every
+radio click used to cost) vs only the selection_form fragment rerunning,
+the way the browser asks for it now.
+
+Run: python -m benchmarks.rerun_latency [--clicks 30]
+
+AppTest always reruns the full script, so fragment reruns are requested
+through its script runner directly, with fragments kept between runs like
+a live session keeps them. No upstream calls are made: the session starts
+with suggestions, a final prompt and a generated image already in place.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from dataclasses import replace
+
+from PIL import Image
+from streamlit.runtime.fragment import MemoryFragmentStorage
+from streamlit.testing.v1 import app_test
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+
+
+class FragmentRunner(LocalScriptRunner):
+    """Script runner sharing one fragment storage, optionally rerunning one fragment"""
+
+    storage = MemoryFragmentStorage()
+    fragment_id = None
+    last = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fragment_storage = FragmentRunner.storage
+        FragmentRunner.last = self
+
+    def request_rerun(self, rerun_data):
+        if FragmentRunner.fragment_id:
+            rerun_data = replace(
+                rerun_data,
+                fragment_id_queue=[FragmentRunner.fragment_id],
+                is_fragment_scoped_rerun=True,
+            )
+        return super().request_rerun(rerun_data)
+
+
+def fragment_id(name):
+    """Id of the stored fragment wrapping the function called name"""
+    for fid, wrapped in FragmentRunner.storage._fragments.items():
+        cells = dict(zip(wrapped.__code__.co_freevars, wrapped.__closure__))
+        if cells["non_optional_func"].cell_contents.__name__ == name:
+            return fid
+    raise LookupError(f"No fragment named {name}")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def seed_session(at):
+    """Suggestions, a built prompt and a stored image, as after a generation"""
+    from utils.llm import CATEGORIES
+    from utils.image_store import image_store
+
+    suggestions = {
+        category: [f"{category} option {i}" for i in range(6)] for category in CATEGORIES
+    }
+    final_prompt = {category: options[0] for category, options in suggestions.items()}
+
+    buf = io.BytesIO()
+    Image.effect_noise((1024, 1024), 64).convert("RGB").save(buf, format="PNG")
+    image_store.put("rerun_latency", buf.getvalue())
+
+    at.session_state["suggestions"] = suggestions
+    at.session_state["user_prompt"] = "dog in a field"
+    at.session_state["final_prompt"] = final_prompt
+    at.session_state["generated_image_key"] = "rerun_latency"
+    at.session_state["generation_time"] = 1.0
+    at.session_state["generation_cached"] = False
+    at.session_state["generation_count_display"] = "1/15"
+    at.session_state["history"] = [
+        {"key": "rerun_latency", "tier": "final", "caption": "dog"}
+    ]
+
+
+def clicks(at, n, fragment=None):
+    """
+    Pick options in turn and time each rerun.
+    Returns: (seconds per rerun, forward messages per rerun)
+    """
+    FragmentRunner.fragment_id = fragment
+    full_tree = at._tree
+    timings, messages = [], []
+    for i in range(n):
+        radio = full_tree.radio[i % len(full_tree.radio)]
+        radio.set_value(radio.options[1 + (i // len(full_tree.radio)) % 5])
+
+        start = time.perf_counter()
+        at._run(full_tree.get_widget_states())
+        timings.append(time.perf_counter() - start)
+        messages.append(len(FragmentRunner.last.forward_msgs()))
+
+    # Fragment runs only return the fragment's elements; keep the whole page
+    at._tree = full_tree
+    FragmentRunner.fragment_id = None
+    return timings, messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clicks", type=int, default=30)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.chdir(tempfile.mkdtemp(prefix="rerun_latency_"))
+    sys.path.insert(0, REPO_ROOT)
+
+    app_test.LocalScriptRunner = FragmentRunner
+    at = app_test.AppTest.from_file(APP_PATH, default_timeout=30)
+    seed_session(at)
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+    # Warm up caches so both modes measure steady-state reruns, after the
+    # app's one-time background warm-up has finished competing for the GIL
+    for thread in threading.enumerate():
+        if thread.name == "warm-up":
+            thread.join()
+    clicks(at, 3)
+    results = {}
+    for mode, fragment in (("full_app", None), ("fragment", fragment_id("selection_form"))):
+        timings, messages = clicks(at, args.clicks, fragment)
+        results[mode] = {
+            "ms_per_rerun": {
+                "p50": 1000 * percentile(timings, 0.5),
+                "p99": 1000 * percentile(timings, 0.99),
+            },
+            "messages_per_rerun": sum(messages) / len(messages),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
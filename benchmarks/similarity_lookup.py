@@ -0,0 +1,128 @@
+"""
+Similarity index lookups at scale: fills an index with synthetic prompts and
+times lookups, inserts and reloading it from disk, after checking that
+prompts with a different meaning do not match.
+
+Run: python -m benchmarks.similarity_lookup [--entries 100000] [--queries 2000]
+"""
+
+import os
+import time
+import json
+import random
+import tempfile
+import argparse
+
+from utils.similarity import SimilarityIndex, prompt_tokens, similarity
+
+SUBJECTS = "dog cat fox owl horse woman man child robot dragon astronaut knight".split()
+ACTIONS = "playing running sleeping reading dancing flying walking sitting".split()
+SETTINGS = "snow forest beach city desert garden space castle river street".split()
+EXTRAS = "golden sunset neon rain fog vintage cozy magical tiny giant".split()
+
+# Pairs that share their words but must never share suggestions
+DIFFERENT_MEANING = [
+    ("cat chasing a dog", "dog chasing a cat"),
+    ("horse riding a man", "man riding a horse"),
+    ("woman not smiling", "woman smiling"),
+    ("a room without windows", "a room with windows"),
+]
+# Rewordings that should
+SAME_MEANING = [
+    ("dog in snow", "a dog playing in the snow"),
+    ("dogs in the snow", "dog in snow"),
+    ("a golden retriever playing in snow", "golden retrievers playing in the snow at sunset"),
+]
+
+
+def sanity_problems(threshold):
+    """Returns: a line per pair scored on the wrong side of the threshold"""
+    problems = []
+    for pairs, should_match in ((DIFFERENT_MEANING, False), (SAME_MEANING, True)):
+        for a, b in pairs:
+            score = similarity(prompt_tokens(a), prompt_tokens(b))
+            if (score >= threshold) != should_match:
+                verb = "matches" if score >= threshold else "does not match"
+                problems.append(f"{a!r} {verb} {b!r} ({score:.2f})")
+    return problems
+
+
+def synthetic_prompt(rng, vocabulary):
+    words = [rng.choice(SUBJECTS), rng.choice(ACTIONS), "in", rng.choice(SETTINGS)]
+    words += rng.sample(EXTRAS, rng.randint(0, 2))
+    # A long tail of rarer words keeps most prompts distinct
+    words += rng.sample(vocabulary, rng.randint(1, 3))
+    return " ".join(words)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    problems = sanity_problems(args.threshold)
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        raise SystemExit(1)
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    db_path = os.path.join(tempfile.mkdtemp(), "similarity_index.db")
+    suggestions = {"subject": ["benchmark"], "style": ["benchmark"]}
+
+    index = SimilarityIndex(db_path, args.threshold, version="benchmark")
+    prompts = [synthetic_prompt(rng, vocabulary) for _ in range(args.entries)]
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        index.add(prompt, suggestions)
+    add_seconds = time.perf_counter() - start
+
+    # Half the queries are near-duplicates of indexed prompts, half are new
+    queries = []
+    for _ in range(args.queries):
+        if rng.random() < 0.5:
+            queries.append("a " + rng.choice(prompts).replace(" in ", " in the "))
+        else:
+            queries.append(synthetic_prompt(rng, vocabulary))
+
+    timings, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        result, matched, score = index.lookup(query)
+        timings.append(time.perf_counter() - start)
+        hits += result is not None
+
+    start = time.perf_counter()
+    reloaded = SimilarityIndex(db_path, args.threshold, version="benchmark")
+    len(reloaded)
+    load_seconds = time.perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "entries": len(index),
+                "add_ms_avg": 1000 * add_seconds / args.entries,
+                "lookup_ms": {
+                    "p50": 1000 * percentile(timings, 0.5),
+                    "p99": 1000 * percentile(timings, 0.99),
+                },
+                "hit_rate": hits / args.queries,
+                "load_seconds": load_seconds,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Time to first pixel: streaming with partial previews vs waiting for the
+full image, measured against the local mock server.
+
+Run: python -m benchmarks.time_to_first_pixel [--image-latency 10] [--runs 3]
+"""
+
+import os
+import time
+import json
+import tempfile
+import argparse
+
+from benchmarks.mock_openai import MockConfig, serve_in_thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--image-latency", type=float, default=10.0)
+    parser.add_argument("--partial-images", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    server, base_url = serve_in_thread(config=MockConfig(image_latency=args.image_latency))
+
+    # Point the shared client at the mock and keep images out of the real store
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ["IMAGE_STORE_MAX_BYTES"] = "0"
+    os.chdir(tempfile.mkdtemp())
+
+    from utils.image_gen import generate_image, generate_image_stream
+
+    results = {"blocking": [], "streaming": []}
+
+    for run in range(args.runs):
+        prompt = {
+            "subject": f"benchmark run {run}",
+            "setting": "mock",
+            "style": "mock",
+            "lighting": "mock",
+            "details": "mock",
+        }
+
+        start = time.time()
+        generate_image(dict(prompt, setting="blocking"))
+        results["blocking"].append(time.time() - start)
+
+        start = time.time()
+        first_pixel = None
+        for kind, image_bytes, elapsed in generate_image_stream(
+            dict(prompt, setting="streaming"), args.partial_images
+        ):
+            if first_pixel is None and image_bytes:
+                first_pixel = time.time() - start
+        results["streaming"].append(first_pixel)
+
+    server.shutdown()
+
+    summary = {
+        mode: {"mean_seconds": sum(times) / len(times), "runs": times}
+        for mode, times in results.items()
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+429 storm simulation: a steady stream of image requests against the local
+mock while its capacity collapses for a while, with the adaptive upstream
+limiter on and with it frozen at its maximum for comparison.
+
+Run: python -m benchmarks.upstream_storm [--requests 80] [--storm 5,15,2]
+
+The mock answers 429 to anything beyond --capacity requests in flight, and
+to --error-rate of all requests on top of that. Before the storm, the
+circuit breaker's half-open trial is checked against a 429 and a
+cancellation. Exits 1 if a check fails, a request fails (without
+--error-rate), or the adaptive limiter does not get fewer 429s than the
+fixed one.
+"""
+
+import os
+import time
+import json
+import asyncio
+import tempfile
+import argparse
+import threading
+
+from benchmarks.mock_openai import MockConfig, serve_in_thread
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def check_half_open_trial():
+    """
+    A half-open trial that gets a 429, or is cancelled, must not leave the
+    breaker stuck "recovering": the next call has to become the trial.
+    Returns: a list of problems, empty if the breaker recovered both times
+    """
+    import httpx
+    import openai
+    from utils.aio import run_sync
+    from utils.clients import CircuitBreaker, call_upstream, breakers, IMAGES
+
+    problems = []
+
+    def half_open_breaker():
+        breaker = CircuitBreaker(IMAGES, failure_threshold=1, reset_seconds=0.1)
+        breaker.record_failure()
+        time.sleep(0.15)
+        breakers[IMAGES] = breaker
+        return breaker
+
+    # A 429 on the trial, then a success on the retry
+    breaker = half_open_breaker()
+    calls = []
+
+    async def throttled_once(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            response = httpx.Response(429, request=httpx.Request("POST", "http://mock"))
+            raise openai.RateLimitError("mock 429", response=response, body=None)
+        return "ok"
+
+    try:
+        result = run_sync(call_upstream(IMAGES, throttled_once))
+    except Exception as e:
+        result = f"{type(e).__name__}: {e}"
+    if result != "ok" or breaker.state() != "closed":
+        problems.append(f"429 on the half-open trial: got {result!r}, {breaker.state()}")
+
+    # A trial cancelled mid-request, then a fresh call
+    breaker = half_open_breaker()
+
+    async def hang(timeout):
+        await asyncio.sleep(60)
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(call_upstream(IMAGES, hang))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async def succeed(timeout):
+            return "ok"
+
+        return await call_upstream(IMAGES, succeed)
+
+    try:
+        result = run_sync(cancel_trial())
+    except Exception as e:
+        result = f"{type(e).__name__}: {e}"
+    if result != "ok" or breaker.state() != "closed":
+        problems.append(f"cancelled half-open trial: got {result!r}, {breaker.state()}")
+
+    breakers[IMAGES] = CircuitBreaker(IMAGES)
+    return problems
+
+
+def throttled_count(report):
+    return sum(
+        count
+        for key, count in report["upstream_requests"].items()
+        if key.endswith(" 429")
+    )
+
+
+def run(args, adaptive):
+    """
+    Fire requests at a fixed rate while the storm plays out.
+    Returns: a report dict for this mode
+    """
+    from utils.clients import limiters, IMAGES, LATENCY_TARGETS
+    from utils.limiter import AdaptiveLimiter
+    from utils.image_gen import generate_image
+
+    config = MockConfig(
+        image_latency=args.image_latency,
+        capacity=args.capacity,
+        error_rate=args.error_rate,
+    )
+    server, base_url = serve_in_thread(config=config)
+    from utils import clients
+
+    clients._client = None
+    os.environ["OPENAI_BASE_URL"] = base_url
+
+    limiter = AdaptiveLimiter(IMAGES, LATENCY_TARGETS[IMAGES])
+    if not adaptive:
+        # Baseline: a fixed limit that ignores 429s and latency
+        limiter.record = lambda seconds, throttled=False: None
+    limiters[IMAGES] = limiter
+
+    storm_start, storm_end, storm_capacity = args.storm
+    results, samples = [], []
+    done = threading.Event()
+
+    def storm():
+        time.sleep(storm_start)
+        config.capacity = storm_capacity
+        time.sleep(storm_end - storm_start)
+        config.capacity = args.capacity
+
+    def sample():
+        start = time.perf_counter()
+        while not done.is_set():
+            samples.append((time.perf_counter() - start, limiter.status()))
+            time.sleep(0.25)
+
+    def request(index):
+        prompt = {
+            "subject": f"storm request {index} {adaptive}",
+            "setting": "mock",
+            "style": "mock",
+            "lighting": "mock",
+            "details": "mock",
+        }
+        start = time.perf_counter()
+        image_bytes, generation_time = generate_image(prompt)
+        results.append((image_bytes is not None, time.perf_counter() - start))
+
+    threading.Thread(target=storm, daemon=True).start()
+    threading.Thread(target=sample, daemon=True).start()
+
+    threads = []
+    for index in range(args.requests):
+        thread = threading.Thread(target=request, args=(index,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(1 / args.rate)
+    for thread in threads:
+        thread.join()
+    done.set()
+    server.shutdown()
+
+    latencies = [seconds for ok, seconds in results if ok]
+    return {
+        "mode": "adaptive" if adaptive else "fixed",
+        "succeeded": len(latencies),
+        "failed": len(results) - len(latencies),
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99),
+        },
+        "min_limit": min(status["limit"] for _, status in samples),
+        "max_queued": max(status["queued"] for _, status in samples),
+        "upstream_requests": config.requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=80)
+    parser.add_argument("--rate", type=float, default=4.0, help="requests per second")
+    parser.add_argument("--image-latency", default="1.0")
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--storm",
+        default="5,15,2",
+        help="START,END,CAPACITY: seconds into the run and capacity during the storm",
+    )
+    parser.add_argument("--mode", choices=("adaptive", "fixed", "both"), default="both")
+    args = parser.parse_args()
+    start, end, capacity = args.storm.split(",")
+    args.storm = (float(start), float(end), int(capacity))
+
+    # Keep images out of the real store and databases out of the repo
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ["IMAGE_STORE_MAX_BYTES"] = "0"
+    os.chdir(tempfile.mkdtemp(prefix="upstream_storm_"))
+
+    problems = check_half_open_trial()
+
+    modes = {"adaptive": [True], "fixed": [False], "both": [False, True]}[args.mode]
+    reports = [run(args, adaptive) for adaptive in modes]
+    print(json.dumps(reports, indent=2))
+
+    for report in reports:
+        if report["failed"] and not args.error_rate:
+            problems.append(f"{report['mode']}: {report['failed']} requests failed")
+    if len(reports) == 2:
+        fixed, adaptive = (throttled_count(report) for report in reports)
+        if adaptive >= fixed:
+            problems.append(f"adaptive got {adaptive} 429s, fixed only {fixed}")
+
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        raise SystemExit(1)
+    print("✅ Breaker recovered from half-open 429s and cancellations; 429s were cut")
+
+
+if __name__ == "__main__":
+    main()
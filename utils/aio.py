@@ -0,0 +1,66 @@
+import queue
+import asyncio
+import threading
+
+_lock = threading.Lock()
+_loop = None
+
+
+def get_loop():
+    """
+    Event loop running in a daemon thread, shared by every caller in the
+    process. The async client and the upstream limiters are used on it.
+    """
+    global _loop
+
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name="upstream-loop", daemon=True
+            )
+            thread.start()
+            _loop = loop
+
+    return _loop
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared loop and block until it finishes"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iterate_sync(agen):
+    """
+    Drive an async generator on the shared loop and yield its items here.
+    If the caller stops early the generator still runs to completion.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        finally:
+            items.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+
+    while True:
+        item = items.get()
+        if item is done:
+            break
+        yield item
+
+    # Re-raise anything the generator raised
+    future.result()
+
+
+async def on_shared_loop(coro):
+    """Await a coroutine on the shared loop, hopping over if called from another loop"""
+    loop = get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
@@ -0,0 +1,243 @@
+"""
+Headless bulk rendering: python -m utils.batch prompts.jsonl --output out/
+
+Each input line is a raw prompt (a JSON string, or {"prompt": ..., "id": ...})
+or a full prompt dict with every category. Raw prompts are analyzed and an
+option is picked per category by --policy. Images are written to
+out/images/<id>.png (ids that are not plain file names become a slug plus
+a short hash) and one result line per item to out/manifest.jsonl; the
+manifest doubles as the checkpoint, so rerunning the same command skips
+items that already finished and retries the ones that failed.
+
+Batch runs call OpenAI directly and are not counted against the app's
+public daily limit.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from utils.aio import run_sync
+from utils.llm import analyze_prompt_async, CATEGORIES
+from utils.image_gen import generate_image_async, prompt_image_key, TIERS, FINAL
+
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+
+DONE = "done"
+FAILED = "failed"
+
+# How to pick one option per category from analyze_prompt's suggestions.
+# rng is seeded with the item id, so a resumed run picks the same options.
+POLICIES = {
+    "first": lambda options, rng: options[0],
+    "random": lambda options, rng: rng.choice(options),
+}
+
+
+def read_items(path):
+    """
+    Parse the input file.
+    Yields (item_id, prompt_dict or None, raw_prompt or None); ids default
+    to the line number and must be unique, as they name the images and key
+    the checkpoint.
+    """
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"prompt": item}
+
+            item_id = str(item.pop("id", line_number))
+            if item_id in seen:
+                raise ValueError(
+                    f"Line {line_number}: id {item_id!r} is used by an earlier line "
+                    "(ids default to the line number)"
+                )
+            seen.add(item_id)
+            if "prompt" in item:
+                yield item_id, None, item["prompt"]
+            elif all(category in item for category in CATEGORIES):
+                yield item_id, {c: item[c] for c in CATEGORIES}, None
+            else:
+                raise ValueError(
+                    f"Line {line_number}: expected a prompt or every category of "
+                    f"{', '.join(CATEGORIES)}"
+                )
+
+
+def image_file_name(item_id):
+    """
+    File name for an item's image. Ids like "shoes/123" or "../x" would
+    point outside out/images, so anything but a plain name becomes a slug
+    plus a hash of the id, which keeps distinct ids apart.
+    """
+    if re.fullmatch(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,99}", item_id):
+        return f"{item_id}.png"
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", item_id).strip("-")[:60]
+    digest = hashlib.sha256(item_id.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}.png" if slug else f"{digest}.png"
+
+
+def choose_options(suggestions, policy, item_id):
+    """Build a prompt dict from analyze_prompt's suggestions with a policy"""
+    rng = random.Random(item_id)
+    return {
+        category: POLICIES[policy](suggestions[category], rng)
+        for category in CATEGORIES
+    }
+
+
+class Manifest:
+    """
+    Append-only JSONL of finished items, written line by line so an
+    interrupted run loses at most the items still in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def finished(self):
+        """Ids whose image was written, by the last entry recorded for each"""
+        status = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line from a killed run
+                        continue
+                    status[entry["id"]] = entry["status"] == DONE and os.path.exists(
+                        entry["image"]
+                    )
+        return {item_id for item_id, done in status.items() if done}
+
+    def append(self, entry):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_image(path, image_bytes):
+    """Write via a temporary file so a listed image is never half written"""
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(image_bytes)
+    os.replace(tmp_path, path)
+
+
+async def render_item(item_id, prompt_dict, raw_prompt, args, manifest):
+    """Analyze (if needed), render and record one item"""
+    start = time.time()
+    image_path = os.path.join(args.output, "images", image_file_name(item_id))
+    entry = {"id": item_id, "prompt": raw_prompt, "tier": args.tier}
+
+    try:
+        if prompt_dict is None:
+            suggestions = await analyze_prompt_async(raw_prompt)
+            if not suggestions:
+                raise RuntimeError("prompt analysis failed")
+            prompt_dict = choose_options(suggestions, args.policy, item_id)
+        entry["prompt_dict"] = prompt_dict
+
+        image_bytes, generation_time = await generate_image_async(
+            prompt_dict, args.tier
+        )
+        if image_bytes is None:
+            raise RuntimeError("image generation failed")
+
+        await asyncio.to_thread(write_image, image_path, image_bytes)
+        entry.update(
+            status=DONE,
+            image=image_path,
+            image_key=prompt_image_key(prompt_dict, args.tier),
+            generation_time=generation_time,
+        )
+    except Exception as e:
+        entry.update(status=FAILED, image=None, error=str(e))
+
+    entry["seconds"] = time.time() - start
+    await asyncio.to_thread(manifest.append, entry)
+    return entry
+
+
+async def run_batch(args):
+    """
+    Render every unfinished item with at most args.concurrency in flight.
+    Returns: counts of done, failed and skipped items
+    """
+    # Reject a bad input file before rendering any of it
+    for _ in read_items(args.input):
+        pass
+
+    os.makedirs(os.path.join(args.output, "images"), exist_ok=True)
+    manifest = Manifest(os.path.join(args.output, "manifest.jsonl"))
+    finished = manifest.finished()
+
+    counts = {DONE: 0, FAILED: 0, "skipped": 0}
+    slots = asyncio.Semaphore(args.concurrency)
+    tasks = set()
+
+    async def run(item):
+        try:
+            entry = await render_item(*item, args, manifest)
+        finally:
+            slots.release()
+        counts[entry["status"]] += 1
+        detail = entry.get("error") or entry["image"]
+        print(f"[{sum(counts.values())}] {entry['id']} {entry['status']}: {detail}")
+
+    # Items are read lazily and started as slots free up, so memory stays
+    # bounded by the concurrency rather than the size of the input
+    for item in read_items(args.input):
+        if item[0] in finished:
+            counts["skipped"] += 1
+            continue
+        await slots.acquire()
+        task = asyncio.create_task(run(item))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file of prompts or prompt dicts")
+    parser.add_argument("--output", default="batch_output")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="first")
+    parser.add_argument("--tier", choices=sorted(TIERS), default=FINAL)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args()
+
+    start = time.time()
+    try:
+        counts = run_sync(run_batch(args))
+    except ValueError as e:
+        print(f"❌ {args.input}: {e}")
+        raise SystemExit(1)
+    print(
+        f"✅ {counts[DONE]} rendered, {counts[FAILED]} failed, "
+        f"{counts['skipped']} already done in {time.time() - start:.1f}s"
+    )
+    if counts[FAILED]:
+        print("Run the same command again to retry the failed items.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
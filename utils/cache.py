@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from utils.paths import DATA_DIR
+
+# Suggestions are stored next to the rate limit database so they survive restarts
+CACHE_DB_PATH = os.path.join(DATA_DIR, "suggestion_cache.db")
+
+MEMORY_MAX_ENTRIES = int(os.environ.get("SUGGESTION_CACHE_MEMORY_ENTRIES", 256))
+DISK_MAX_ENTRIES = int(os.environ.get("SUGGESTION_CACHE_DISK_ENTRIES", 5000))
+TTL_SECONDS = int(os.environ.get("SUGGESTION_CACHE_TTL", 7 * 24 * 3600))
+
+
+def normalize_prompt(text):
+    """
+    Normalize a prompt so trivially different inputs share a cache entry.
+    Lowercases, drops punctuation and collapses whitespace.
+    """
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+class SuggestionCache:
+    """
+    Two-tier cache for analyze_prompt results: an in-process LRU in front of
+    a SQLite table. Both tiers expire entries after ttl_seconds and evict the
+    least recently used entries once they hold more than their max size.
+    """
+
+    def __init__(
+        self,
+        db_path=CACHE_DB_PATH,
+        memory_max_entries=MEMORY_MAX_ENTRIES,
+        disk_max_entries=DISK_MAX_ENTRIES,
+        ttl_seconds=TTL_SECONDS,
+    ):
+        self.db_path = db_path
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+        self.miss_tokens = 0
+
+    def _connect(self):
+        """Open the shared connection and create the table on first use"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS suggestion_cache
+                (key TEXT PRIMARY KEY, value TEXT, created_at REAL, last_access REAL)
+            """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """
+        Look up suggestions for a cache key.
+        Returns: a fresh copy of the cached dict, or None on a miss
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return json.loads(value)
+                del self._memory[key]
+
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT value, created_at FROM suggestion_cache WHERE key = ?",
+                    (key,),
+                ).fetchone()
+
+                if row and now - row[1] < self.ttl_seconds:
+                    conn.execute(
+                        "UPDATE suggestion_cache SET last_access = ? WHERE key = ?",
+                        (now, key),
+                    )
+                    conn.commit()
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+            except sqlite3.Error as e:
+                print(f"Error reading suggestion cache: {e}")
+
+            return None
+
+    def set(self, key, suggestions):
+        """Store suggestions in both tiers and evict anything over budget"""
+        now = time.time()
+        value = json.dumps(suggestions)
+
+        with self._lock:
+            self._remember(key, now, value)
+
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO suggestion_cache VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                conn.execute(
+                    "DELETE FROM suggestion_cache WHERE created_at < ?",
+                    (now - self.ttl_seconds,),
+                )
+                conn.execute(
+                    """
+                    DELETE FROM suggestion_cache WHERE key IN
+                    (SELECT key FROM suggestion_cache
+                     ORDER BY last_access DESC LIMIT -1 OFFSET ?)
+                """,
+                    (self.disk_max_entries,),
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing suggestion cache: {e}")
+
+    def recent(self, prefix, limit):
+        """
+        Most recently used unexpired entries whose key starts with prefix.
+        Returns: list of (key, suggestions), most recent first
+        """
+        with self._lock:
+            try:
+                rows = self._connect().execute(
+                    "SELECT key, value FROM suggestion_cache "
+                    "WHERE substr(key, 1, ?) = ? AND created_at > ? "
+                    "ORDER BY last_access DESC LIMIT ?",
+                    (len(prefix), prefix, time.time() - self.ttl_seconds, limit),
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"Error reading suggestion cache: {e}")
+                rows = []
+
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def _remember(self, key, created_at, value):
+        """Insert into the in-process LRU, evicting the oldest entry if full"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def record_miss(self, seconds, tokens=0):
+        """Record the cost of an upstream call made because of a miss"""
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += seconds
+            self.miss_tokens += tokens
+
+    def stats(self):
+        """
+        Hit/miss counters plus an estimate of the time and tokens saved,
+        based on the average cost of a miss.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            avg_seconds = self.miss_seconds / self.misses if self.misses else 0.0
+            avg_tokens = self.miss_tokens / self.misses if self.misses else 0.0
+
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "avg_miss_seconds": avg_seconds,
+                "est_seconds_saved": hits * avg_seconds,
+                "est_tokens_saved": int(hits * avg_tokens),
+            }
+
+
+suggestion_cache = SuggestionCache()
@@ -0,0 +1,243 @@
+import os
+import time
+import threading
+
+from utils.limiter import AdaptiveLimiter
+
+CHAT = "chat"
+IMAGES = "images"
+
+# Per-endpoint read timeouts: chat answers in seconds, images can take a minute+
+TIMEOUTS = {CHAT: 30.0, IMAGES: 180.0}
+CONNECT_TIMEOUT = 5.0
+
+# Calls slower than this count as congestion and shrink the concurrency limit.
+# Streamed images are measured to the first byte, not the finished image.
+LATENCY_TARGETS = {CHAT: 10.0, IMAGES: 90.0}
+
+MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 20))
+MAX_ATTEMPTS = 3
+BACKOFF_MAX_SECONDS = 8
+# 429s are retried past MAX_ATTEMPTS until this long after the first attempt,
+# while the limiter shrinks concurrency to what upstream will accept
+THROTTLED_RETRY_SECONDS = 60
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+_lock = threading.Lock()
+_client = None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint that is currently failing"""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive upstream failures and fails
+    fast until reset_seconds have passed. Then a single trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_seconds=BREAKER_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if calls should not go upstream right now.
+        Returns: True if this call is the half-open trial, which must end in
+        record_success, record_failure or release_trial
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                raise CircuitOpenError(f"{self.name} upstream is unavailable")
+
+            if self._trial_in_flight:
+                raise CircuitOpenError(f"{self.name} upstream is recovering")
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        End a trial that said nothing about upstream health (a 429, or the
+        caller was cancelled) without opening or closing the circuit, so
+        the next call can be the trial.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def state(self):
+        """closed, open or half-open"""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+            return "half-open"
+
+
+breakers = {CHAT: CircuitBreaker(CHAT), IMAGES: CircuitBreaker(IMAGES)}
+
+limiters = {
+    CHAT: AdaptiveLimiter(CHAT, LATENCY_TARGETS[CHAT]),
+    IMAGES: AdaptiveLimiter(IMAGES, LATENCY_TARGETS[IMAGES]),
+}
+
+
+def upstream_slot(endpoint):
+    """
+    Adaptive limit on in-flight requests to an endpoint; waits in its queue
+    when full. Must be used from coroutines running on the shared loop.
+    """
+    return limiters[endpoint].slot()
+
+
+def timeout(endpoint):
+    """httpx timeout for requests to an endpoint"""
+    import httpx
+
+    return httpx.Timeout(TIMEOUTS[endpoint], connect=CONNECT_TIMEOUT)
+
+
+def is_throttled(exc):
+    import openai
+
+    return isinstance(exc, openai.APIStatusError) and exc.status_code == 429
+
+
+def is_retryable(exc):
+    """429s, 5xx responses, timeouts and connection errors are worth retrying"""
+    import openai
+
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def should_stop_retrying(retry_state):
+    """Stop after MAX_ATTEMPTS, except keep retrying 429s for a while longer"""
+    if retry_state.seconds_since_start >= THROTTLED_RETRY_SECONDS:
+        return True
+    if is_throttled(retry_state.outcome.exception()):
+        return False
+    return retry_state.attempt_number >= MAX_ATTEMPTS
+
+
+def get_async_client():
+    """
+    Process-wide AsyncOpenAI client on a single keep-alive connection pool.
+    SDK retries are disabled; call_upstream owns the retry policy.
+    """
+    global _client
+
+    with _lock:
+        if _client is None:
+            # The SDK takes most of a second to import, so the app only loads
+            # it when the first client is built
+            import httpx
+            from openai import AsyncOpenAI
+
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                    keepalive_expiry=60,
+                ),
+                timeout=timeout(IMAGES),
+            )
+            _client = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                http_client=http_client,
+                max_retries=0,
+            )
+
+    return _client
+
+
+def warm_up_client():
+    """
+    Build the client ahead of the first request, along with the SDK modules
+    and retry machinery requests use. Meant for a background thread.
+    """
+    # Imported by call_upstream on the first request otherwise
+    import tenacity  # noqa: F401
+
+    client = get_async_client()
+    # The SDK imports each resource's module on first access
+    _ = client.chat.completions, client.images
+
+
+async def call_upstream(endpoint, request, **kwargs):
+    """
+    Await request(**kwargs) with the endpoint's timeout, retrying 429/5xx
+    with jittered exponential backoff (429s for up to THROTTLED_RETRY_SECONDS).
+    Every attempt goes through the endpoint's circuit breaker, so a storm of
+    failures stops retries early, and feeds its latency and any 429 back to
+    the endpoint's limiter. 429s only shrink the limiter; they do not trip
+    the breaker.
+    """
+    from tenacity import AsyncRetrying, retry_if_exception, wait_random_exponential
+
+    breaker = breakers[endpoint]
+    limiter = limiters[endpoint]
+
+    async for attempt in AsyncRetrying(
+        stop=should_stop_retrying,
+        wait=wait_random_exponential(multiplier=0.5, max=BACKOFF_MAX_SECONDS),
+        retry=retry_if_exception(is_retryable),
+        reraise=True,
+    ):
+        with attempt:
+            trial = breaker.before_call()
+            start = time.monotonic()
+            try:
+                result = await request(timeout=timeout(endpoint), **kwargs)
+            except Exception as e:
+                if is_throttled(e):
+                    limiter.record(time.monotonic() - start, throttled=True)
+                elif is_retryable(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            else:
+                limiter.record(time.monotonic() - start)
+                breaker.record_success()
+            finally:
+                # A 429 or a cancellation settles nothing; hand the trial back
+                # so the circuit cannot stay "recovering" forever
+                if trial:
+                    breaker.release_trial()
+
+    return result
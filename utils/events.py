@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import argparse
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from utils.paths import DATA_DIR
+
+# Parquet files partitioned by UTC day, events/date=YYYY-MM-DD/*.parquet,
+# so pandas.read_parquet(EVENTS_DIR) reads them all with a date column
+EVENTS_DIR = os.environ.get("EVENTS_DIR", os.path.join(DATA_DIR, "events"))
+EVENTS_FLUSH_SECONDS = float(os.environ.get("EVENTS_FLUSH_SECONDS", 10))
+# Flush early once this many events are waiting
+EVENTS_BATCH_SIZE = int(os.environ.get("EVENTS_BATCH_SIZE", 5000))
+# Beyond this many unflushed events (e.g. the disk is failing) the oldest are dropped
+EVENTS_MAX_BUFFERED = int(os.environ.get("EVENTS_MAX_BUFFERED", 100000))
+# Merge a writer's part files for a day once it has written this many
+COMPACT_PARTS = int(os.environ.get("EVENTS_COMPACT_PARTS", 24))
+# Files of past days untouched for this long are left over by processes that
+# have exited, and are merged by whichever process finds them
+ORPHAN_SECONDS = float(os.environ.get("EVENTS_ORPHAN_SECONDS", 600))
+
+ANALYZE = "analyze"
+SELECT = "select"
+GENERATE = "generate"
+
+
+def event_schema():
+    """
+    One flat schema for every event; fields an event does not have are null.
+    pyarrow is only imported when events are written or read, off the
+    request path.
+    """
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("ts", pa.timestamp("ms", tz="UTC")),
+            ("event", pa.string()),
+            ("session", pa.string()),
+            # The user's prompt as typed
+            ("prompt", pa.string()),
+            ("category", pa.string()),
+            ("option", pa.string()),
+            # Position of the picked option among the suggestions; null if custom
+            ("rank", pa.int32()),
+            ("custom", pa.bool_()),
+            ("tier", pa.string()),
+            ("seconds", pa.float64()),
+            ("cached", pa.bool_()),
+            ("edited", pa.bool_()),
+            ("ok", pa.bool_()),
+            # JSON: an analysis' suggestions, a generation's prompt dict
+            ("data", pa.string()),
+        ]
+    )
+
+
+def event_date(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def write_table(path, table):
+    """Write via a hidden temporary file, which Parquet readers skip"""
+    import pyarrow.parquet as pq
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class EventLog:
+    """
+    Append-only analytics events. log() only appends to an in-memory buffer;
+    a background thread writes the buffer out as a Parquet part file every
+    flush_seconds and merges each day's parts into one file per process as
+    they pile up. Once a day it also merges what exited processes left for
+    past days into one file, claiming each file by renaming it first, so
+    several processes can share one events directory.
+    """
+
+    def __init__(
+        self,
+        root=EVENTS_DIR,
+        flush_seconds=EVENTS_FLUSH_SECONDS,
+        batch_size=EVENTS_BATCH_SIZE,
+        max_buffered=EVENTS_MAX_BUFFERED,
+        compact_parts=COMPACT_PARTS,
+        orphan_seconds=ORPHAN_SECONDS,
+    ):
+        self.root = root
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.compact_parts = compact_parts
+        self.orphan_seconds = orphan_seconds
+
+        self._lock = threading.Lock()
+        self._buffer = deque(maxlen=max_buffered)
+        self._dropped = 0
+        self._wake = threading.Event()
+        self._flusher = None
+
+        # Serializes flushes from the background thread, atexit and callers
+        self._flush_lock = threading.Lock()
+        self._writer = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._sequence = 0
+        self._parts = {}  # date -> this writer's uncompacted part files
+        self._orphans_checked = None  # date orphaned files were last merged
+
+    def log(self, event, **fields):
+        """
+        Record one event with any event_schema() fields, e.g.
+        log(GENERATE, tier="final", seconds=12.3, cached=False).
+        """
+        fields["ts"] = time.time()
+        fields["event"] = event
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped += 1
+            self._buffer.append(fields)
+            if len(self._buffer) >= self.batch_size:
+                self._wake.set()
+            self._start_flusher()
+
+    def _start_flusher(self):
+        # Called with the lock held
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="events-flush", daemon=True
+            )
+            self._flusher.start()
+            # Daemon threads die with the process; write what is left on exit
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write buffered events as part files, then compact where due"""
+        import pyarrow as pa
+
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            print(f"Dropped {dropped} analytics events")
+
+        with self._flush_lock:
+            try:
+                self._write_parts(rows)
+                self._compact_due()
+                today = event_date(time.time())
+                if self._orphans_checked != today:
+                    self._compact_orphans(today)
+                    self._orphans_checked = today
+            except (OSError, pa.ArrowException) as e:
+                print(f"Error flushing analytics events: {e}")
+
+    def _write_parts(self, rows):
+        import pyarrow as pa
+
+        by_date = {}
+        for row in rows:
+            by_date.setdefault(event_date(row["ts"]), []).append(row)
+
+        for date, day_rows in by_date.items():
+            for row in day_rows:
+                # Serialized here rather than in log() to keep the caller's cost flat
+                row["ts"] = int(row["ts"] * 1000)
+                if "data" in row:
+                    row["data"] = json.dumps(row["data"], ensure_ascii=False)
+
+            directory = os.path.join(self.root, f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            self._sequence += 1
+            path = os.path.join(
+                directory, f"part-{self._writer}-{self._sequence:06d}.parquet"
+            )
+            write_table(path, pa.Table.from_pylist(day_rows, schema=event_schema()))
+            self._parts.setdefault(date, []).append(path)
+
+    def _compact_due(self):
+        today = event_date(time.time())
+        for date, parts in list(self._parts.items()):
+            # Past days get no more parts from this writer; close them off
+            if len(parts) >= self.compact_parts or (date != today and parts):
+                self._compact(date, parts)
+            if date != today:
+                del self._parts[date]
+
+    def _compact_orphans(self, today):
+        """Merge other writers' files for each past day into this writer's file"""
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - self.orphan_seconds
+
+        for name in sorted(os.listdir(self.root)):
+            date = name.partition("=")[2]
+            if not name.startswith("date=") or date >= today:
+                continue
+            directory = os.path.join(self.root, name)
+
+            orphans = []
+            for file_name in os.listdir(directory):
+                if (
+                    not file_name.endswith(".parquet")
+                    or file_name.startswith(".")
+                    or self._writer in file_name
+                ):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        orphans.append(path)
+                except FileNotFoundError:
+                    # Claimed by another process meanwhile
+                    continue
+            own = os.path.join(directory, f"events-{self._writer}.parquet")
+            if len(orphans) + os.path.exists(own) < 2:
+                continue
+
+            claimed = []
+            for path in orphans:
+                claim = os.path.join(
+                    directory, f"claimed-{self._writer}-{uuid.uuid4().hex[:8]}.parquet"
+                )
+                try:
+                    os.rename(path, claim)
+                except FileNotFoundError:
+                    # Another process claimed it first
+                    continue
+                claimed.append(claim)
+            if claimed:
+                self._compact(date, claimed)
+
+    def _compact(self, date, parts):
+        """Merge this writer's parts for a day into its single compacted file"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.root, f"date={date}")
+        compacted = os.path.join(directory, f"events-{self._writer}.parquet")
+
+        sources = ([compacted] if os.path.exists(compacted) else []) + parts
+        schema = event_schema()
+        table = pa.concat_tables(
+            [pq.read_table(path, schema=schema) for path in sources]
+        )
+        # Until the parts are removed a reader may see these events twice
+        write_table(compacted, table)
+        for path in parts:
+            os.remove(path)
+        self._parts[date] = []
+
+
+event_log = EventLog()
+
+
+def log_event(event, **fields):
+    event_log.log(event, **fields)
+
+
+def read_events(root=EVENTS_DIR, event=None, columns=None):
+    """
+    Load the event log for analysis.
+    Returns: a pandas DataFrame, one row per event, with a date column
+    """
+    import pandas as pd
+
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=columns or event_schema().names)
+    filters = [("event", "==", event)] if event else None
+    return pd.read_parquet(root, columns=columns, filters=filters)
+
+
+# Summary of what users pick: python -m utils.events [--dir data/events]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarize the analytics event log"
+    )
+    parser.add_argument("--dir", default=EVENTS_DIR)
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    selections = read_events(args.dir, SELECT)
+    if len(selections):
+        print("Picks by category (custom share, then most picked suggestion ranks):")
+        for category, picks in selections.groupby("category"):
+            ranks = picks["rank"].dropna().astype(int).value_counts(normalize=True)
+            top = ", ".join(
+                f"#{rank + 1} {share:.0%}" for rank, share in ranks.head(args.top).items()
+            )
+            print(f"  {category}: {picks['custom'].mean():.0%} custom; {top}")
+
+    generations = read_events(args.dir, GENERATE)
+    if len(generations):
+        print("Generations by tier:")
+        for tier, rows in generations.groupby("tier"):
+            rendered = rows[~rows["cached"]]
+            print(
+                f"  {tier}: {len(rows)} ({rows['cached'].mean():.0%} from cache, "
+                f"{rows['edited'].mean():.0%} edits), "
+                f"median {rendered['seconds'].median():.1f}s to render"
+            )
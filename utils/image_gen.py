@@ -1,22 +1,85 @@
-import os
 import time
 import base64
-from openai import OpenAI
-from dotenv import load_dotenv
+import asyncio
+import concurrent.futures
+from utils.aio import get_loop, iterate_sync, on_shared_loop, run_sync
+from utils.clients import (
+    get_async_client,
+    call_upstream,
+    upstream_slot,
+    limiters,
+    IMAGES,
+)
+from utils.image_store import image_store, image_key
+from utils.metrics import metrics, timer, incr
+from utils.singleflight import SingleFlight
 
-load_dotenv()
+MODEL = "gpt-image-1.5"
+SIZE = "1024x1024"
+QUALITY = "medium"
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+DRAFT = "draft"
+FINAL = "final"
 
+# Stream event while a render waits in the upstream queue
+QUEUED = "queued"
 
-def generate_image(prompt_dict):
+# Render settings and daily-limit cost per quality tier. gpt-image models
+# have no size below 1024x1024, so drafts are cheaper through quality alone.
+TIERS = {
+    DRAFT: {"size": SIZE, "quality": "low", "cost": 0.25},
+    FINAL: {"size": SIZE, "quality": QUALITY, "cost": 1},
+}
+
+# Regenerating after changing at most this many categories edits the
+# previous render instead of starting from scratch
+MAX_EDIT_CATEGORIES = 2
+# An edit keeps most of the image, so it counts for less than a full render
+EDIT_COST = 0.5
+
+# Images per request the model accepts; dall-e-3 only supports n=1
+MAX_IMAGES_PER_REQUEST = 1 if MODEL == "dall-e-3" else 10
+
+image_flights = SingleFlight("generate_image")
+
+# Progressive previews sent before the final image in streaming mode (0-3)
+PARTIAL_IMAGES = 2
+
+
+def prompt_image_key(prompt_dict, tier=FINAL, variant=0):
     """
-    Generate image from structured prompt dictionary.
-    Returns: (image_bytes, generation_time) or (None, 0) on error
+    Image store key the render of this prompt at a tier is saved under.
+    variant numbers the extra images of a generate_images batch.
     """
+    settings = TIERS[tier]
+    return image_key(
+        prompt_dict, MODEL, settings["size"], settings["quality"], variant
+    )
 
-    # Convert JSON prompt to natural language
-    prompt_text = f"""Create an image with the following specifications:
+
+def edit_image_key(prompt_dict, edit):
+    """
+    Image store key an edit of edit["key"] into prompt_dict is saved under.
+    Kept apart from prompt_image_key, which only ever addresses renders from
+    scratch, so an edit is never served as a render of its prompt.
+    """
+    settings = TIERS[FINAL]
+    return image_key(
+        prompt_dict, MODEL, settings["size"], settings["quality"], edit=edit
+    )
+
+
+def get_cached_image(prompt_dict, tier=FINAL):
+    """
+    Look up a previously rendered image for this prompt without calling the API.
+    Returns: image_bytes or None
+    """
+    return image_store.get(prompt_image_key(prompt_dict, tier))
+
+
+def build_prompt_text(prompt_dict):
+    """Convert JSON prompt to natural language"""
+    return f"""Create an image with the following specifications:
 
 Subject: {prompt_dict['subject']}
 Setting: {prompt_dict['setting']}
@@ -26,20 +89,198 @@ Additional details: {prompt_dict['details']}
 
 Generate a cohesive, high-quality image incorporating all these elements."""
 
+
+def build_edit_prompt_text(prompt_dict, changed):
+    """Instruction for editing a render into prompt_dict where changed categories differ"""
+    changes = "\n".join(f"{category.title()}: {prompt_dict[category]}" for category in changed)
+    return f"""Edit this image so it matches these new specifications:
+
+{changes}
+
+Keep the composition and everything else in the image unchanged."""
+
+
+def changed_categories(previous_prompt, prompt_dict):
+    """Categories whose selection differs from the previous prompt"""
+    return [
+        category
+        for category, value in prompt_dict.items()
+        if value != previous_prompt.get(category)
+    ]
+
+
+def plan_edit(previous_prompt, previous_key, prompt_dict):
+    """
+    Decide whether a new final render can be an edit of the previous one.
+    Returns: {"key": previous image store key, "changed": [categories]} or
+    None to generate from scratch
+    """
+    if not previous_prompt or not previous_key:
+        return None
+    changed = changed_categories(previous_prompt, prompt_dict)
+    if not 0 < len(changed) <= MAX_EDIT_CATEGORIES:
+        return None
+    if not image_store.contains(previous_key):
+        return None
+    return {"key": previous_key, "changed": changed}
+
+
+def edit_image(prompt_dict, edit, charge=None):
+    """
+    Render prompt_dict by editing the stored image from plan_edit.
+    The result is stored under edit_image_key. charge works as for
+    generate_image and is asked for EDIT_COST.
+    Returns: (image_bytes, generation_time) or (None, 0) on error or denial
+    """
+    return run_sync(on_shared_loop(_edit_image(prompt_dict, edit, charge)))
+
+
+async def _edit_image(prompt_dict, edit, charge):
+    start_time = time.time()
+
+    key = edit_image_key(prompt_dict, edit)
+    with timer("image.cache_lookup"):
+        cached = await asyncio.to_thread(image_store.get, key)
+    if cached is not None:
+        incr("image.cache_hits")
+        return cached, time.time() - start_time
+
+    # Identical edits in flight share one upstream call (and one charge). An
+    # edit is a different image from a full render of the same prompt, so it
+    # never joins a render's flight.
+    return await _charged_flight(
+        key,
+        lambda charge: _request_edit(prompt_dict, edit, key, charge, start_time),
+        charge,
+    )
+
+
+async def _request_edit(prompt_dict, edit, key, charge, start_time):
     try:
-        start_time = time.time()
-
-        response = client.images.generate(
-            model="gpt-image-1.5",
-            prompt=prompt_text,
-            size="1024x1024",
-            quality="medium",
-            n=1,
-        )
+        base = await asyncio.to_thread(image_store.get, edit["key"])
+        if base is None:
+            return None, 0
+
+        async with upstream_slot(IMAGES):
+            if charge is not None and not await asyncio.to_thread(charge):
+                return None, 0
+
+            with timer("image.edit_request"):
+                response = await call_upstream(
+                    IMAGES,
+                    get_async_client().images.edit,
+                    model=MODEL,
+                    image=("image.png", base, "image/png"),
+                    prompt=build_edit_prompt_text(prompt_dict, edit["changed"]),
+                    size=TIERS[FINAL]["size"],
+                    quality=TIERS[FINAL]["quality"],
+                    n=1,
+                )
+
+        generation_time = time.time() - start_time
+        with timer("image.b64_decode"):
+            image_bytes = base64.b64decode(response.data[0].b64_json)
+        metrics.record("image.edit", generation_time)
+        incr("image.generated.edit")
+
+        await asyncio.to_thread(image_store.put, key, image_bytes)
+
+        return image_bytes, generation_time
+
+    except Exception as e:
+        print(f"Error editing image: {e}")
+        return None, 0
+
+
+def generate_image(prompt_dict, tier=FINAL, charge=None):
+    """
+    Generate image from structured prompt dictionary.
+    tier selects the DRAFT or FINAL render settings. charge, if given, is
+    called right before an upstream request and must return True to allow it;
+    it is skipped for cached images and for callers sharing another's request.
+    Returns: (image_bytes, generation_time) or (None, 0) on error or denial
+    """
+    return run_sync(generate_image_async(prompt_dict, tier, charge))
+
+
+async def generate_image_async(prompt_dict, tier=FINAL, charge=None):
+    """
+    Async version of generate_image, sharing the process-wide client and
+    upstream concurrency limit.
+    """
+    return await on_shared_loop(_generate_image(prompt_dict, tier, charge))
+
+
+async def _generate_image(prompt_dict, tier, charge):
+    start_time = time.time()
+
+    key = prompt_image_key(prompt_dict, tier)
+    with timer("image.cache_lookup"):
+        cached = await asyncio.to_thread(image_store.get, key)
+    if cached is not None:
+        incr("image.cache_hits")
+        return cached, time.time() - start_time
+
+    # Identical requests in flight share one upstream call (and one charge)
+    return await _charged_flight(
+        key,
+        lambda charge: _request_image(prompt_dict, tier, key, charge, start_time),
+        charge,
+    )
+
+
+async def _charged_flight(key, request, charge):
+    """
+    Run request(charge) through image_flights. A denial only applies to the
+    caller whose charge refused it: callers who shared that flight start
+    (or join) another, where their own charge is asked.
+    Returns: request's result
+    """
+    while True:
+
+        async def lead():
+            refused = False
+
+            def own_charge():
+                nonlocal refused
+                refused = not charge()
+                return not refused
+
+            result = await request(own_charge if charge is not None else None)
+            return result, refused
+
+        (result, refused), shared = await image_flights.do(key, lead)
+        if not (shared and refused):
+            return result
+
+
+async def _request_image(prompt_dict, tier, key, charge, start_time):
+    settings = TIERS[tier]
+
+    try:
+        async with upstream_slot(IMAGES):
+            # Charged only once a slot is held, so rejected requests cost nothing
+            if charge is not None and not await asyncio.to_thread(charge):
+                return None, 0
+
+            with timer("image.request"):
+                response = await call_upstream(
+                    IMAGES,
+                    get_async_client().images.generate,
+                    model=MODEL,
+                    prompt=build_prompt_text(prompt_dict),
+                    size=settings["size"],
+                    quality=settings["quality"],
+                    n=1,
+                )
 
         generation_time = time.time() - start_time
         image_b64 = response.data[0].b64_json
-        image_bytes = base64.b64decode(image_b64)
+        with timer("image.b64_decode"):
+            image_bytes = base64.b64decode(image_b64)
+        incr(f"image.generated.{tier}")
+
+        await asyncio.to_thread(image_store.put, key, image_bytes)
 
         return image_bytes, generation_time
 
@@ -48,6 +289,240 @@ Generate a cohesive, high-quality image incorporating all these elements."""
         return None, 0
 
 
+def generate_image_stream(
+    prompt_dict, partial_images=PARTIAL_IMAGES, tier=FINAL, charge=None
+):
+    """
+    Generate an image, yielding progressively refined previews first.
+    Yields (QUEUED, None, position) while waiting for an upstream slot,
+    ("partial", image_bytes, elapsed) for each preview, then
+    ("final", image_bytes, generation_time), ("final", None, 0) on error,
+    or ("denied", None, 0) if charge refused the upstream request.
+    """
+    return iterate_sync(
+        _generate_image_stream(prompt_dict, partial_images, tier, charge)
+    )
+
+
+async def _generate_image_stream(prompt_dict, partial_images, tier, charge):
+    start_time = time.time()
+
+    key = prompt_image_key(prompt_dict, tier)
+    with timer("image.cache_lookup"):
+        cached = await asyncio.to_thread(image_store.get, key)
+    if cached is not None:
+        incr("image.cache_hits")
+        yield "final", cached, time.time() - start_time
+        return
+
+    # Identical requests in flight share one upstream stream (and one charge).
+    # A denial only applies to the caller whose charge refused it; callers who
+    # shared that flight start (or join) another, where their own is asked.
+    asked = False
+
+    def own_charge():
+        nonlocal asked
+        asked = True
+        return charge()
+
+    while True:
+        refused = False
+        async for item in image_flights.stream(
+            key,
+            lambda: _stream_image(
+                prompt_dict,
+                partial_images,
+                tier,
+                key,
+                own_charge if charge is not None else None,
+                start_time,
+            ),
+        ):
+            if item[0] == "denied" and not asked:
+                refused = True
+            else:
+                yield item
+        if not refused:
+            return
+
+
+async def _stream_image(prompt_dict, partial_images, tier, key, charge, start_time):
+    settings = TIERS[tier]
+
+    try:
+        # Report the place in line while waiting for a free upstream slot
+        limiter = limiters[IMAGES]
+        async for position in limiter.wait_for_slot():
+            yield QUEUED, None, position
+
+        try:
+            # Charged only once a slot is held, so rejected requests cost nothing
+            if charge is not None and not await asyncio.to_thread(charge):
+                yield "denied", None, 0
+                return
+
+            stream = await call_upstream(
+                IMAGES,
+                get_async_client().images.generate,
+                model=MODEL,
+                prompt=build_prompt_text(prompt_dict),
+                size=settings["size"],
+                quality=settings["quality"],
+                n=1,
+                stream=True,
+                partial_images=partial_images,
+            )
+
+            image_bytes = None
+            async for event in stream:
+                with timer("image.b64_decode"):
+                    frame = base64.b64decode(event.b64_json)
+
+                if event.type == "image_generation.partial_image":
+                    elapsed = time.time() - start_time
+                    if event.partial_image_index == 0:
+                        metrics.record("image.first_partial", elapsed)
+                    yield "partial", frame, elapsed
+                elif event.type == "image_generation.completed":
+                    image_bytes = frame
+
+        finally:
+            limiter.release()
+
+        if image_bytes is None:
+            raise RuntimeError("stream ended without a completed image")
+
+        generation_time = time.time() - start_time
+        metrics.record("image.stream", generation_time)
+        incr(f"image.generated.{tier}")
+        await asyncio.to_thread(image_store.put, key, image_bytes)
+
+    except Exception as e:
+        print(f"Error generating image: {e}")
+        yield "final", None, 0
+        return
+
+    yield "final", image_bytes, generation_time
+
+
+def count_uncached_images(prompt_dicts, n_per_prompt):
+    """Number of images a generate_images call would actually have to render"""
+    return sum(
+        not image_store.contains(image_key(prompt_dict, MODEL, SIZE, QUALITY, v))
+        for prompt_dict in prompt_dicts
+        for v in range(n_per_prompt)
+    )
+
+
+def _plan_batches(prompt_dicts, n_per_prompt):
+    """
+    Split the work into cached hits and upstream requests.
+    Returns: (hits, requests) where hits are (prompt_index, variant) pairs and
+    each request is (prompt_index, [variants]) sized to MAX_IMAGES_PER_REQUEST
+    """
+    hits = []
+    requests = []
+
+    for idx, prompt_dict in enumerate(prompt_dicts):
+        missing = []
+        for variant in range(n_per_prompt):
+            key = image_key(prompt_dict, MODEL, SIZE, QUALITY, variant)
+            if image_store.contains(key):
+                hits.append((idx, variant))
+            else:
+                missing.append(variant)
+
+        for i in range(0, len(missing), MAX_IMAGES_PER_REQUEST):
+            requests.append((idx, missing[i : i + MAX_IMAGES_PER_REQUEST]))
+
+    return hits, requests
+
+
+async def _generate_batch(prompt_index, prompt_dict, variants):
+    """
+    Render several variants of one prompt with a single n>1 request.
+    Returns: list of (prompt_index, variant, image_bytes, generation_time)
+    """
+    start_time = time.time()
+
+    try:
+        async with upstream_slot(IMAGES):
+            with timer("image.batch_request"):
+                response = await call_upstream(
+                    IMAGES,
+                    get_async_client().images.generate,
+                    model=MODEL,
+                    prompt=build_prompt_text(prompt_dict),
+                    size=SIZE,
+                    quality=QUALITY,
+                    n=len(variants),
+                )
+
+        generation_time = time.time() - start_time
+        results = []
+        incr(f"image.generated.{FINAL}", len(response.data))
+
+        for variant, image in zip(variants, response.data):
+            with timer("image.b64_decode"):
+                image_bytes = base64.b64decode(image.b64_json)
+            key = image_key(prompt_dict, MODEL, SIZE, QUALITY, variant)
+            await asyncio.to_thread(image_store.put, key, image_bytes)
+            results.append((prompt_index, variant, image_bytes, generation_time))
+
+        return results
+
+    except Exception as e:
+        print(f"Error generating image batch: {e}")
+        return [(prompt_index, variant, None, 0) for variant in variants]
+
+
+def _cached_result(prompt_dicts, prompt_index, variant):
+    key = image_key(prompt_dicts[prompt_index], MODEL, SIZE, QUALITY, variant)
+    return prompt_index, variant, image_store.get(key), 0.0
+
+
+def generate_images(prompt_dicts, n_per_prompt=1):
+    """
+    Generate n_per_prompt images for each prompt dictionary.
+    Yields (prompt_index, variant, image_bytes, generation_time) as each
+    image completes; image_bytes is None for images that failed.
+    """
+    hits, requests = _plan_batches(prompt_dicts, n_per_prompt)
+
+    loop = get_loop()
+    futures = [
+        asyncio.run_coroutine_threadsafe(
+            _generate_batch(idx, prompt_dicts[idx], variants), loop
+        )
+        for idx, variants in requests
+    ]
+
+    for idx, variant in hits:
+        yield _cached_result(prompt_dicts, idx, variant)
+
+    for future in concurrent.futures.as_completed(futures):
+        yield from future.result()
+
+
+async def generate_images_async(prompt_dicts, n_per_prompt=1):
+    """Async generator version of generate_images"""
+    hits, requests = _plan_batches(prompt_dicts, n_per_prompt)
+
+    tasks = [
+        asyncio.ensure_future(
+            on_shared_loop(_generate_batch(idx, prompt_dicts[idx], variants))
+        )
+        for idx, variants in requests
+    ]
+
+    for idx, variant in hits:
+        yield _cached_result(prompt_dicts, idx, variant)
+
+    for task in asyncio.as_completed(tasks):
+        for result in await task:
+            yield result
+
+
 # Test function
 if __name__ == "__main__":
     test_prompt = {
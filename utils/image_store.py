@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from utils.paths import DATA_DIR
+
+IMAGE_STORE_DIR = os.path.join(DATA_DIR, "images")
+IMAGE_STORE_MAX_BYTES = int(
+    os.environ.get("IMAGE_STORE_MAX_BYTES", 512 * 1024 * 1024)
+)
+
+
+def image_key(prompt_dict, model, size, quality, variant=0, edit=None):
+    """
+    Content address for a rendered image: a hash of the canonicalized prompt
+    dict (sorted keys, collapsed whitespace) plus the render parameters.
+    variant numbers the extra images of a batch rendered from one prompt.
+    edit (a plan_edit plan) addresses an edit of another image instead, which
+    never shares a key with a render of the same prompt.
+    """
+    canonical_prompt = {
+        str(k).strip(): " ".join(str(v).split()) for k, v in prompt_dict.items()
+    }
+    fields = {
+        "prompt": canonical_prompt,
+        "model": model,
+        "size": size,
+        "quality": quality,
+    }
+    if variant:
+        fields["variant"] = variant
+    if edit:
+        fields["edit"] = {"base": edit["key"], "changed": sorted(edit["changed"])}
+
+    payload = json.dumps(
+        fields,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageStore:
+    """
+    Content-addressed image files under root, sharded as ab/cd/<key>.
+    Writes are atomic (temp file + rename) and the store is kept under
+    max_bytes by evicting the least recently used images.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR, max_bytes=IMAGE_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._index = None  # key -> size, oldest access first
+        self._total_bytes = 0
+
+    def path(self, key):
+        """Sharded location of an image on disk"""
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _load_index(self):
+        """Scan the store once per process, ordering entries by last access"""
+        if self._index is not None:
+            return
+
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name, stat.st_size))
+
+        entries.sort()
+        self._index = OrderedDict((name, size) for _, name, size in entries)
+        self._total_bytes = sum(self._index.values())
+
+    def get(self, key):
+        """
+        Read an image from the store.
+        Returns: image bytes, or None if the key is not stored
+        """
+        path = self.path(key)
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Touch the file so last access survives restarts
+            os.utime(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self._total_bytes += len(data)
+            self._index[key] = len(data)
+            self._index.move_to_end(key)
+
+        return data
+
+    def open(self, key):
+        """
+        Open a stored image for streamed reads instead of loading it whole.
+        Returns: a binary file object the caller must close, or None
+        """
+        path = self.path(key)
+
+        try:
+            f = open(path, "rb")
+            os.utime(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            self._load_index()
+            if key in self._index:
+                self._index.move_to_end(key)
+
+        return f
+
+    def contains(self, key):
+        """Check for an image without reading it"""
+        return os.path.exists(self.path(key))
+
+    def put(self, key, data):
+        """Atomically write an image, then evict until under the byte budget"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing image store: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._load_index()
+            self._total_bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used images while over budget"""
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            old_key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+
+    def total_bytes(self):
+        """Bytes currently tracked by the store"""
+        with self._lock:
+            self._load_index()
+            return self._total_bytes
+
+
+image_store = ImageStore()
@@ -0,0 +1,163 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.image_store import image_store
+from utils.metrics import timer, incr
+
+DISPLAY = "display"
+THUMBNAIL = "thumbnail"
+DEMO = "demo"
+
+# (longest side, JPEG quality) per variant. st.image passes JPEG bytes that fit
+# the column straight to the browser; PNG or WebP bytes it decodes and
+# re-encodes as JPEG on every rerun.
+VARIANTS = {
+    DISPLAY: (1024, 85),
+    THUMBNAIL: (512, 80),
+    # Static demo images: a half-width column on desktop or the full width of
+    # a phone, both at 2x density. The server cannot tell which, so one size
+    # has to serve both.
+    DEMO: (768, 82),
+}
+
+# Variants encoded for every finished render
+RENDER_VARIANTS = (DISPLAY, THUMBNAIL)
+
+VARIANT_CACHE_MAX_BYTES = int(
+    os.environ.get("VARIANT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+
+
+def content_hash(image_bytes):
+    """Hex digest identifying an image by its bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def encode_variant(image, kind):
+    """
+    Downscale an image (bytes or a binary file) and encode it as a compact
+    progressive JPEG.
+    Returns: JPEG bytes
+    """
+    # Imported here: most reruns are served from the caches and never decode
+    from PIL import Image
+
+    max_side, quality = VARIANTS[kind]
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+
+    with Image.open(image) as image:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            # JPEG has no alpha; flatten onto white like the app background
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+
+    return buf.getvalue()
+
+
+class VariantCache:
+    """In-process LRU of encoded variants, bounded by total bytes"""
+
+    def __init__(self, max_bytes=VARIANT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._total_bytes -= len(self._entries.pop(key, b""))
+            self._entries[key] = data
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._total_bytes -= len(old_data)
+
+
+variant_cache = VariantCache()
+
+
+def _variant(variant_key, kind, load, persist):
+    data = variant_cache.get(variant_key)
+    if data is not None:
+        incr("image.variant_hits")
+        return data
+
+    data = image_store.get(variant_key) if persist else None
+    if data is None:
+        source = load()
+        if source is None:
+            return None
+        with source, timer("image.variant_encode"):
+            data = encode_variant(source, kind)
+        if persist:
+            image_store.put(variant_key, data)
+
+    variant_cache.put(variant_key, data)
+    return data
+
+
+def image_variant(image_bytes, kind=DISPLAY, persist=True):
+    """
+    Compact display copy of an image, encoded once per content hash and kind.
+    Looks in memory, then in the image store (shared across processes), and
+    encodes on a miss. persist=False keeps short-lived images like progress
+    previews out of the store.
+    Returns: JPEG bytes
+    """
+    return _variant(
+        f"{content_hash(image_bytes)}.{kind}",
+        kind,
+        lambda: io.BytesIO(image_bytes),
+        persist,
+    )
+
+
+def stored_image_variant(key, kind=DISPLAY):
+    """
+    Compact display copy of the image stored under key. The original is only
+    streamed from disk when the variant is not cached, so sessions can keep
+    just the key.
+    Returns: JPEG bytes, or None if the image has been evicted
+    """
+    return _variant(f"{key}.{kind}", kind, lambda: image_store.open(key), True)
+
+
+def file_variant(path, kind=DEMO):
+    """
+    Compact display copy of an image file, keyed by its path, size and
+    modification time so it is only re-encoded when the file changes.
+    Returns: JPEG bytes
+    """
+    stat = os.stat(path)
+    file_id = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return _variant(
+        f"{content_hash(file_id.encode())}.{kind}",
+        kind,
+        lambda: open(path, "rb"),
+        True,
+    )
+
+
+def prepare_variants(key, image_bytes):
+    """Encode every variant of a finished image ahead of its first display"""
+    for kind in RENDER_VARIANTS:
+        _variant(f"{key}.{kind}", kind, lambda: io.BytesIO(image_bytes), True)
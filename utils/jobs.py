@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.paths import DB_PATH
+from utils.image_gen import (
+    generate_image_stream,
+    edit_image,
+    edit_image_key,
+    prompt_image_key,
+    EDIT_COST,
+    PARTIAL_IMAGES,
+    QUEUED as STREAM_QUEUED,
+    TIERS,
+    FINAL,
+)
+from utils.image_variants import prepare_variants
+from utils.rate_limit import (
+    check_rate_limit,
+    refund_rate_limit,
+    check_user_quota,
+    refund_user_quota,
+    user_quota_message,
+)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+
+# Queued/running jobs untouched for this long are assumed orphaned by a
+# restarted process and picked up again
+STALE_JOB_SECONDS = 300
+# Finished jobs are deleted this long after they finished; sessions pick up
+# their results within seconds
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", 24 * 3600))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Image generation jobs persisted in SQLite and run by a worker pool,
+    independent of the Streamlit script run that submitted them.
+    Each job is charged against its client's quota and the daily limit at most
+    once, keyed on its ID; both remember charge IDs in SQLite, so retries and
+    restarts never charge it again. Jobs for the same image running at the
+    same time share one upstream request and one charge.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_workers=JOB_WORKERS):
+        self.db_path = db_path
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job-worker"
+        )
+        self._lock = threading.Lock()
+        self._conn = None
+        self._previews = {}  # job_id -> latest partial image bytes
+        self._positions = {}  # job_id -> place in the upstream queue
+
+    def _connect(self):
+        """Open the shared connection, create the table and resume orphaned jobs"""
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs
+                (id TEXT PRIMARY KEY, status TEXT, prompt TEXT, image_key TEXT,
+                 generation_time REAL, error TEXT, attempts INTEGER,
+                 created_at REAL, updated_at REAL)
+            """
+            )
+            # Jobs created before quality tiers existed are final renders
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "tier" not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN tier TEXT DEFAULT '{FINAL}'")
+            # Jobs created before per-client quotas only count globally
+            if "client_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN client_id TEXT")
+            # Final renders planned as an edit of an earlier image (plan_edit JSON)
+            if "edit" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN edit TEXT")
+            self._conn = conn
+            self._resume_stale()
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _resume_stale(self):
+        rows = self._conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (QUEUED, RUNNING, time.time() - STALE_JOB_SECONDS),
+        ).fetchall()
+        for (job_id,) in rows:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (QUEUED, time.time(), job_id),
+            )
+            self._executor.submit(self._run, job_id)
+
+    def submit(self, prompt_dict, tier=FINAL, client_id=None, edit=None):
+        """
+        Queue an image generation at a quality tier, charged to client_id's
+        quota (if given) as well as the global daily limit. With an edit plan
+        from plan_edit the previous image is edited instead, falling back to
+        a full render if the edit fails.
+        Returns: the job ID to poll with get()
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        self._execute(
+            "INSERT INTO jobs (id, status, prompt, attempts, created_at, updated_at, "
+            "tier, client_id, edit) VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                QUEUED,
+                json.dumps(prompt_dict),
+                now,
+                now,
+                tier,
+                client_id,
+                json.dumps(edit) if edit else None,
+            ),
+        )
+        self._executor.submit(self._run, job_id)
+        self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (DONE, FAILED, now - JOB_RETENTION_SECONDS),
+        )
+
+        return job_id
+
+    def retry(self, job_id):
+        """Re-queue a failed job; it is not charged again if it already was"""
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, error = NULL, updated_at = ? "
+            "WHERE id = ? AND status = ? RETURNING id",
+            (QUEUED, time.time(), job_id, FAILED),
+        )
+        if rows:
+            self._executor.submit(self._run, job_id)
+
+    def get(self, job_id):
+        """
+        Current state of a job.
+        Returns: dict with status, prompt, tier, edited (rendered as an edit),
+        image_key, generation_time, error, preview (latest partial image bytes,
+        if any) and queue_position (place in the upstream queue while waiting
+        for a slot), or None if unknown
+        """
+        rows = self._execute(
+            "SELECT status, prompt, tier, edit, image_key, generation_time, error "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        if not rows:
+            return None
+
+        status, prompt, tier, edit, key, generation_time, error = rows[0]
+        return {
+            "status": status,
+            "prompt": json.loads(prompt),
+            "tier": tier,
+            "edited": edit is not None,
+            "image_key": key,
+            "generation_time": generation_time,
+            "error": error,
+            "preview": self._previews.get(job_id),
+            "queue_position": self._positions.get(job_id),
+        }
+
+    def _update(self, job_id, status, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(
+            f"UPDATE jobs SET status = ?, updated_at = ?"
+            f"{', ' + columns if columns else ''} WHERE id = ?",
+            (status, time.time(), *fields.values(), job_id),
+        )
+
+    def _run(self, job_id):
+        # Claim the job so a second worker (or process) does not run it too
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ? AND status = ? RETURNING prompt, tier, client_id, edit",
+            (RUNNING, time.time(), job_id, QUEUED),
+        )
+        if not rows:
+            return
+
+        prompt_dict = json.loads(rows[0][0])
+        tier, client_id = rows[0][1], rows[0][2]
+        edit = json.loads(rows[0][3]) if rows[0][3] else None
+        key = prompt_image_key(prompt_dict, tier)
+        denial = None
+
+        def charger(cost, charge_id):
+            """
+            Charge callback for one upstream request. Only called when this
+            job's render actually goes upstream, so cached images and jobs
+            sharing another job's request are free.
+            """
+
+            def charge():
+                nonlocal denial
+                if client_id is not None:
+                    allowed, retry_after = check_user_quota(client_id, cost, charge_id)
+                    if not allowed:
+                        denial = user_quota_message(retry_after)
+                        return False
+
+                can_generate, current_count, max_count = check_rate_limit(
+                    cost, charge_id=charge_id
+                )
+                if not can_generate:
+                    if client_id is not None:
+                        refund_user_quota(client_id, cost, charge_id)
+                    denial = (
+                        "Daily limit reached! You've used all "
+                        f"{max_count} generations today. Please try again tomorrow."
+                    )
+                return can_generate
+
+            return charge
+
+        try:
+            image_bytes, generation_time = None, 0
+
+            if edit:
+                # Edits are charged separately, so a failed edit that falls
+                # back to a full render is not mistaken for an earlier charge
+                edit_charge = f"{job_id}.edit"
+                image_bytes, generation_time = edit_image(
+                    prompt_dict, edit, charger(EDIT_COST, edit_charge)
+                )
+                if denial:
+                    self._update(job_id, FAILED, error=denial)
+                    return
+                if image_bytes is None:
+                    # A failed edit is not paid for; the full render is charged as usual
+                    refund_rate_limit(edit_charge)
+                    if client_id is not None:
+                        refund_user_quota(client_id, EDIT_COST, edit_charge)
+                    self._execute("UPDATE jobs SET edit = NULL WHERE id = ?", (job_id,))
+                else:
+                    key = edit_image_key(prompt_dict, edit)
+
+            if image_bytes is None:
+                charge = charger(TIERS[tier]["cost"], job_id)
+                for kind, frame, elapsed in generate_image_stream(
+                    prompt_dict, PARTIAL_IMAGES, tier, charge
+                ):
+                    if kind == STREAM_QUEUED:
+                        self._positions[job_id] = elapsed
+                    elif kind == "partial":
+                        self._positions.pop(job_id, None)
+                        self._previews[job_id] = frame
+                    elif kind == "denied":
+                        self._update(
+                            job_id,
+                            FAILED,
+                            error=denial or "Failed to generate image. Please try again.",
+                        )
+                        return
+                    else:
+                        image_bytes, generation_time = frame, elapsed
+
+            if image_bytes:
+                # Encode the display copies now rather than on the first rerun
+                prepare_variants(key, image_bytes)
+                self._update(
+                    job_id, DONE, image_key=key, generation_time=generation_time
+                )
+            else:
+                self._update(
+                    job_id, FAILED, error="Failed to generate image. Please try again."
+                )
+
+        except Exception as e:
+            print(f"Error running job {job_id}: {e}")
+            self._update(job_id, FAILED, error="Failed to generate image. Please try again.")
+
+        finally:
+            self._previews.pop(job_id, None)
+            self._positions.pop(job_id, None)
+
+
+job_queue = JobQueue()
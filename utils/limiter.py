@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from utils.metrics import metrics, incr
+
+# Bounds on the adaptive per-endpoint limit of OpenAI requests in flight
+MAX_UPSTREAM_CONCURRENCY = int(os.environ.get("MAX_UPSTREAM_CONCURRENCY", 8))
+MIN_UPSTREAM_CONCURRENCY = 1
+
+# Requests waiting for a slot beyond this are rejected instead of queued
+MAX_QUEUED_REQUESTS = int(os.environ.get("UPSTREAM_MAX_QUEUE", 64))
+
+DECREASE_FACTOR = 0.5
+# At most one decrease per window, so one burst of 429s halves the limit once
+DECREASE_COOLDOWN_SECONDS = 2.0
+
+
+class QueueFullError(Exception):
+    """Raised when too many requests are already waiting for an upstream slot"""
+
+
+class _Waiter:
+    def __init__(self):
+        self.granted = False
+        self.changed = asyncio.Event()
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one upstream endpoint, adjusted by additive
+    increase / multiplicative decrease: every fast successful call raises
+    the limit by 1/limit (about one slot per limit's worth of calls), a 429
+    or a call slower than latency_target halves it. Requests over the limit
+    wait first come, first served in a bounded queue.
+    Must be used from coroutines running on the shared loop.
+    """
+
+    def __init__(
+        self,
+        name,
+        latency_target,
+        max_limit=MAX_UPSTREAM_CONCURRENCY,
+        min_limit=MIN_UPSTREAM_CONCURRENCY,
+        max_queue=MAX_QUEUED_REQUESTS,
+        decrease_cooldown=DECREASE_COOLDOWN_SECONDS,
+    ):
+        self.name = name
+        self.latency_target = latency_target
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.max_queue = max_queue
+        self.decrease_cooldown = decrease_cooldown
+
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = float("-inf")
+
+    async def wait_for_slot(self):
+        """
+        Async generator that yields this request's 1-based queue position
+        each time it changes, and finishes once a slot is held. The caller
+        must call release() afterwards.
+        Raises QueueFullError if the queue is already full.
+        """
+        if not self._waiters and self._in_flight < int(self.limit):
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            incr(f"limiter.{self.name}.rejected")
+            raise QueueFullError(f"Too many {self.name} requests waiting upstream")
+
+        waiter = _Waiter()
+        self._waiters.append(waiter)
+        incr(f"limiter.{self.name}.queued")
+        start = time.monotonic()
+
+        position = None
+        try:
+            while True:
+                waiter.changed.clear()
+                if waiter.granted:
+                    break
+                if self._waiters.index(waiter) + 1 != position:
+                    position = self._waiters.index(waiter) + 1
+                    yield position
+                await waiter.changed.wait()
+        except BaseException:
+            # Cancelled or abandoned: give back the slot or the place in line
+            if waiter.granted:
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                self._notify_waiters()
+            raise
+
+        metrics.record(f"limiter.{self.name}.wait", time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for the body of an async with block, waiting if needed"""
+        async for position in self.wait_for_slot():
+            pass
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def record(self, seconds, throttled=False):
+        """Feed back one upstream call: its latency and whether it got a 429"""
+        if throttled or seconds > self.latency_target:
+            now = time.monotonic()
+            # While more calls are in flight than the limit allows, congestion
+            # is from before the last decrease and is not counted again
+            if (
+                now - self._last_decrease >= self.decrease_cooldown
+                and self._in_flight <= self.limit
+            ):
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+                incr(f"limiter.{self.name}.decreases")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters in arrival order"""
+        granted = False
+        while self._waiters and self._in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.changed.set()
+            self._in_flight += 1
+            granted = True
+        if granted:
+            self._notify_waiters()
+
+    def _notify_waiters(self):
+        # Every remaining waiter moved up the queue
+        for waiter in self._waiters:
+            waiter.changed.set()
+
+    def status(self):
+        """Current limit, requests in flight and requests queued"""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+        }
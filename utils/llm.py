@@ -1,10 +1,24 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import json
+import time
+import hashlib
 
-load_dotenv()
+import jiter
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from utils.aio import on_shared_loop, run_sync, iterate_sync
+from utils.clients import (
+    get_async_client,
+    call_upstream,
+    warm_up_client,
+    limiters,
+    CHAT,
+)
+from utils.cache import suggestion_cache, normalize_prompt
+from utils.metrics import metrics, timer, incr
+from utils.similarity import SimilarityIndex
+from utils.suggestion_pack import SuggestionPack
+from utils.singleflight import SingleFlight
+
+MODEL = "gpt-4o-mini"
 
 # Fixed categories for prompt enhancement
 CATEGORIES = {
@@ -15,14 +29,21 @@ CATEGORIES = {
     "details": "Additional elements, objects, or features",
 }
 
+# Placeholder prompts shown in the app; always part of the suggestion pack
+EXAMPLE_PROMPTS = [
+    "golden retriever playing in snow",
+    "photographer capturing sunset over mountains",
+    "woman walking through cyberpunk city street",
+    "barista working in cozy coffee shop interior",
+    "astronaut riding a horse on alien planet",
+    "deer standing in magical forest with glowing mushrooms",
+    "couple driving vintage car on desert highway",
+    "monk meditating in zen garden with koi pond",
+    "pilot navigating steampunk airship through clouds",
+    "child watching cat reading a book",
+]
 
-def analyze_prompt(user_prompt):
-    """
-    Takes a generic user prompt and returns suggested options for each category.
-    Returns a dict with category names as keys and lists of suggestions as values.
-    """
-
-    system_prompt = """You are an expert at enhancing image generation prompts.
+SYSTEM_PROMPT = """You are an expert at enhancing image generation prompts.
 Given a user's basic prompt, generate creative and diverse suggestions for each category.
 
 IMPORTANT RULES:
@@ -44,43 +65,238 @@ Return your response as a JSON object with this structure:
   "details": ["option 1", "option 2", ...]
 }"""
 
-    user_message = f"""User's prompt: "{user_prompt}"
+USER_MESSAGE_TEMPLATE = """User's prompt: "{user_prompt}"
 
 Generate suggestions for these categories:
-- subject: {CATEGORIES['subject']} - MUST include the action/pose/activity from the user's prompt
-- setting: {CATEGORIES['setting']}
-- style: {CATEGORIES['style']} (MUST include "Photorealistic, high detail, natural colors" as first option)
-- lighting: {CATEGORIES['lighting']}
-- details: {CATEGORIES['details']}
+- subject: {subject} - MUST include the action/pose/activity from the user's prompt
+- setting: {setting}
+- style: {style} (MUST include "Photorealistic, high detail, natural colors" as first option)
+- lighting: {lighting}
+- details: {details}
 
 Remember: The subject options should describe both WHO/WHAT and WHAT THEY'RE DOING."""
 
+# Yielded as (QUEUED, position) while an analysis waits in the upstream queue
+QUEUED = "queued"
+
+REALISTIC_OPTION = "Photorealistic, high detail, natural colors"
+
+# Identical prompts analyzed at the same time share one upstream stream
+suggestion_flights = SingleFlight("analyze_prompt")
+
+# Cached suggestions are only reused while the model and prompts stay the same
+PROMPT_VERSION = hashlib.sha256(
+    (MODEL + SYSTEM_PROMPT + USER_MESSAGE_TEMPLATE).encode("utf-8")
+).hexdigest()[:12]
+
+
+# Near-duplicate prompts reuse each other's suggestions under the same version
+similarity_index = SimilarityIndex(version=PROMPT_VERSION)
+
+# Prebuilt suggestions for example and common prompts, mapped at startup
+suggestion_pack = SuggestionPack(version=PROMPT_VERSION)
+
+
+def warm_up():
+    """
+    Do the one-time work of a process's first analysis ahead of it: build the
+    upstream client and load the similarity index from disk.
+    """
+    warm_up_client()
+    similarity_index.load()
+
+
+def suggestion_cache_key(user_prompt):
+    """Cache key for a user prompt under the current model/prompt version"""
+    return f"{PROMPT_VERSION}:{normalize_prompt(user_prompt)}"
+
+
+def analyze_prompt(user_prompt):
+    """
+    Takes a generic user prompt and returns suggested options for each category.
+    Returns a dict with category names as keys and lists of suggestions as values.
+    """
+    return run_sync(analyze_prompt_async(user_prompt))
+
+
+async def analyze_prompt_async(user_prompt):
+    """
+    Async version of analyze_prompt, sharing the process-wide client and
+    upstream concurrency limit.
+    """
+    return await on_shared_loop(_analyze_prompt(user_prompt))
+
+
+async def analyze_prompt_upstream_async(user_prompt):
+    """
+    Like analyze_prompt_async, but always asks the model: the cache, the
+    suggestion pack and similar prompts are not consulted. For building the
+    suggestion pack, which must not be filled from itself or from neighbours.
+    """
+    return await on_shared_loop(_analyze_prompt(user_prompt, upstream_only=True))
+
+
+async def _analyze_prompt(user_prompt, upstream_only=False):
+    suggestions = {}
+    async for category, options in _analyze_prompt_stream(user_prompt, upstream_only):
+        if category is None:
+            return None
+        if category != QUEUED:
+            suggestions[category] = options
+    return suggestions
+
+
+def analyze_prompt_stream(user_prompt):
+    """
+    Like analyze_prompt, but yields (category, options) as soon as each
+    category's option list is complete, so the UI can render them one by one.
+    Yields (QUEUED, position) while waiting for an upstream slot, and
+    (None, None) last if the analysis failed.
+    """
+    return iterate_sync(_analyze_prompt_stream(user_prompt))
+
+
+async def _analyze_prompt_stream(user_prompt, upstream_only=False):
+    cache_key = suggestion_cache_key(user_prompt)
+    if upstream_only:
+        async for item in _shared_suggestions(user_prompt, cache_key):
+            yield item
+        return
+
+    with timer("llm.cache_lookup"):
+        cached = suggestion_cache.get(cache_key)
+    if cached is not None:
+        incr("llm.cache_hits")
+        for category, options in cached.items():
+            yield category, options
+        return
+
+    with timer("llm.pack_lookup"):
+        packed = suggestion_pack.get(user_prompt)
+    if packed is not None:
+        incr("llm.pack_hits")
+        for category, options in packed.items():
+            yield category, options
+        return
+
+    with timer("llm.similarity_lookup"):
+        similar, matched_prompt, score = similarity_index.lookup(user_prompt)
+    if similar is not None:
+        incr("llm.similar_hits")
+        for category, options in similar.items():
+            yield category, options
+        return
+
+    async for item in _shared_suggestions(user_prompt, cache_key):
+        yield item
+
+
+async def _shared_suggestions(user_prompt, cache_key):
+    # Identical prompts analyzed at the same time share one upstream stream
+    async for category, options in suggestion_flights.stream(
+        cache_key, lambda: _stream_suggestions(user_prompt, cache_key)
+    ):
+        # Every reader gets its own copy of the shared lists
+        if isinstance(options, list):
+            options = list(options)
+        yield category, options
+
+
+def ensure_realistic_option(category, options):
+    """Safety check: ensure realistic option is in style"""
+    if category == "style" and REALISTIC_OPTION not in options:
+        options.insert(0, REALISTIC_OPTION)
+    return options
+
+
+def completed_categories(content):
+    """
+    Parse a partial JSON response and return the categories whose option
+    lists are complete: every key but the last, and the last one too once
+    the object could be closed right after it.
+    """
+    try:
+        return jiter.from_json((content.rstrip().rstrip(",") + "}").encode("utf-8"))
+    except ValueError:
+        pass
+
+    partial = jiter.from_json(content.encode("utf-8"), partial_mode=True)
+    return dict(list(partial.items())[:-1])
+
+
+async def _stream_suggestions(user_prompt, cache_key):
+    user_message = USER_MESSAGE_TEMPLATE.format(user_prompt=user_prompt, **CATEGORIES)
+
+    start_time = time.time()
+    tokens = 0
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.8,
-        )
+        # Report the place in line while waiting for a free upstream slot
+        limiter = limiters[CHAT]
+        async for position in limiter.wait_for_slot():
+            yield QUEUED, position
+
+        try:
+            with timer("llm.request"):
+                stream = await call_upstream(
+                    CHAT,
+                    get_async_client().chat.completions.create,
+                    model=MODEL,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": user_message},
+                    ],
+                    response_format={"type": "json_object"},
+                    temperature=0.8,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+
+            content = ""
+            sent = set()
+            async for chunk in stream:
+                if chunk.usage:
+                    tokens = chunk.usage.total_tokens
+                    incr("llm.prompt_tokens", chunk.usage.prompt_tokens)
+                    incr("llm.completion_tokens", chunk.usage.completion_tokens)
+
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                content += delta
 
-        import json
+                # A category's list can only have completed if this chunk closed a list
+                if "]" not in delta:
+                    continue
+                with timer("llm.json_parse"):
+                    completed = completed_categories(content)
+                for category, options in completed.items():
+                    if category not in sent:
+                        if not sent:
+                            metrics.record("llm.first_category", time.time() - start_time)
+                        sent.add(category)
+                        yield category, ensure_realistic_option(category, options)
 
-        suggestions = json.loads(response.choices[0].message.content)
+        finally:
+            limiter.release()
 
-        # Safety check: ensure realistic option is in style
-        if "style" in suggestions:
-            realistic_option = "Photorealistic, high detail, natural colors"
-            if realistic_option not in suggestions["style"]:
-                suggestions["style"].insert(0, realistic_option)
+        with timer("llm.json_parse"):
+            suggestions = json.loads(content)
 
-        return suggestions
+        for category, options in suggestions.items():
+            ensure_realistic_option(category, options)
+            if category not in sent:
+                yield category, options
+
+        suggestion_cache.set(cache_key, suggestions)
+        similarity_index.add(user_prompt, suggestions)
 
     except Exception as e:
         print(f"Error in analyze_prompt: {e}")
-        return None
+        yield None, None
+
+    finally:
+        suggestion_cache.record_miss(time.time() - start_time, tokens)
 
 
 if __name__ == "__main__":
@@ -89,7 +305,6 @@ if __name__ == "__main__":
 
     if result:
         print("Suggestions:")
-        import json
 
         print(json.dumps(result, indent=2))
 
@@ -99,3 +314,10 @@ if __name__ == "__main__":
             print("\n❌ Warning: Realistic option missing!")
     else:
         print("Failed to get suggestions")
+
+    print("\nStreaming the same prompt:")
+    start = time.time()
+    for category, options in analyze_prompt_stream(test_prompt):
+        print(f"  {time.time() - start:.2f}s {category}: {options}")
+
+    print(f"\nCache stats: {suggestion_cache.stats()}")
@@ -0,0 +1,206 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils.paths import DATA_DIR
+
+METRICS_DB_PATH = os.path.join(DATA_DIR, "metrics.db")
+
+# Most recent timing samples kept in memory for percentiles
+METRICS_BUFFER_SIZE = int(os.environ.get("METRICS_BUFFER_SIZE", 10000))
+FLUSH_SECONDS = 30
+# Timing samples older than this are deleted from the metrics table on flush
+METRICS_RETENTION_SECONDS = float(
+    os.environ.get("METRICS_RETENTION_SECONDS", 7 * 24 * 3600)
+)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics:
+    """
+    In-memory ring buffer of per-stage timings plus counters, flushed to a
+    SQLite metrics table in the background every flush_seconds. The table
+    keeps the last retention_seconds of samples.
+    """
+
+    def __init__(
+        self,
+        db_path=METRICS_DB_PATH,
+        buffer_size=METRICS_BUFFER_SIZE,
+        flush_seconds=FLUSH_SECONDS,
+        retention_seconds=METRICS_RETENTION_SECONDS,
+    ):
+        self.db_path = db_path
+        self.flush_seconds = flush_seconds
+        self.retention_seconds = retention_seconds
+
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=buffer_size)  # (timestamp, stage, seconds)
+        self._counters = {}
+        self._unflushed = []
+        self._flusher = None
+
+        # Flushes share one connection, opened on the first
+        self._flush_lock = threading.Lock()
+        self._conn = None
+
+    def record(self, stage, seconds):
+        """Record one timing sample for a stage"""
+        with self._lock:
+            sample = (time.time(), stage, seconds)
+            self._samples.append(sample)
+            self._unflushed.append(sample)
+            self._start_flusher()
+
+    def incr(self, counter, amount=1):
+        """Add to a counter, e.g. tokens used or cache hits"""
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+            self._start_flusher()
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as one sample of stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def percentiles(self):
+        """
+        Latency percentiles over the samples in the ring buffer.
+        Returns: {stage: {"count": n, "p50": s, "p95": s, "p99": s}}
+        """
+        with self._lock:
+            by_stage = {}
+            for _, stage, seconds in self._samples:
+                by_stage.setdefault(stage, []).append(seconds)
+
+        summary = {}
+        for stage, values in sorted(by_stage.items()):
+            values.sort()
+            summary[stage] = {"count": len(values)}
+            for q in QUANTILES:
+                index = min(len(values) - 1, int(q * len(values)))
+                summary[stage][f"p{int(q * 100)}"] = values[index]
+        return summary
+
+    def samples(self, prefix=""):
+        """Raw (timestamp, stage, seconds) samples in the buffer, optionally by stage prefix"""
+        with self._lock:
+            return [sample for sample in self._samples if sample[1].startswith(prefix)]
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def prometheus_text(self):
+        """Percentiles and counters in the Prometheus text exposition format"""
+        lines = [
+            "# HELP app_stage_seconds Per-stage latency over recent samples",
+            "# TYPE app_stage_seconds summary",
+        ]
+        for stage, stats in self.percentiles().items():
+            for q in QUANTILES:
+                lines.append(
+                    f'app_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                    f"{stats[f'p{int(q * 100)}']:.6f}"
+                )
+            lines.append(f'app_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+        lines.append("# HELP app_events_total Counters such as tokens and cache hits")
+        lines.append("# TYPE app_events_total counter")
+        for counter, value in sorted(self.counters().items()):
+            lines.append(f'app_events_total{{name="{counter}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def _start_flusher(self):
+        # Called with the lock held
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="metrics-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def _connect(self):
+        """Open the flush connection and set up the schema once per process"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics (ts REAL, stage TEXT, seconds REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS metrics_ts ON metrics (ts)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def flush(self):
+        """Write samples recorded since the last flush and current counters"""
+        with self._lock:
+            samples, self._unflushed = self._unflushed, []
+            counters = dict(self._counters)
+
+        with self._flush_lock:
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("INSERT INTO metrics VALUES (?, ?, ?)", samples)
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO counters VALUES (?, ?)", counters.items()
+                    )
+                    conn.execute(
+                        "DELETE FROM metrics WHERE ts < ?",
+                        (time.time() - self.retention_seconds,),
+                    )
+            except sqlite3.Error as e:
+                print(f"Error flushing metrics: {e}")
+
+
+metrics = Metrics()
+
+
+def timer(stage):
+    """Time a block: with timer("llm.request"): ..."""
+    return metrics.timer(stage)
+
+
+def incr(counter, amount=1):
+    metrics.incr(counter, amount)
+
+
+def start_metrics_server(port):
+    """Serve prometheus_text() at http://0.0.0.0:<port>/metrics on a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
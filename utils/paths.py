@@ -0,0 +1,10 @@
+import os
+
+# Detect if running on HF Spaces and use persistent storage
+DATA_DIR = "/data" if os.path.exists("/data") else "."
+
+DB_PATH = os.path.join(DATA_DIR, "rate_limits.db")
+
+# Static images shipped with the app, found relative to the code rather than
+# the working directory
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
@@ -0,0 +1,521 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from utils.paths import DB_PATH
+from utils.metrics import timer, incr
+
+MAX_GENERATIONS = int(os.environ.get("DAILY_GENERATION_LIMIT", 15))
+
+# Per-client quota: up to USER_GENERATION_QUOTA generations, refilled
+# continuously over USER_QUOTA_WINDOW_SECONDS (a rolling window, no midnight reset)
+USER_GENERATION_QUOTA = float(os.environ.get("USER_GENERATION_QUOTA", 5))
+USER_QUOTA_WINDOW_SECONDS = float(os.environ.get("USER_QUOTA_WINDOW_SECONDS", 24 * 3600))
+# How often changed per-client buckets are written back to SQLite
+QUOTA_FLUSH_SECONDS = 5
+# Recent charge IDs remembered (and persisted with the buckets) so a retried
+# or resumed job is not charged twice
+MAX_REMEMBERED_CHARGES = 10000
+
+# How long the sidebar may show a count without re-reading the database.
+# Writes from this process refresh it immediately; this only bounds how
+# stale writes from other processes can look.
+REMAINING_CACHE_SECONDS = 5
+
+
+class RateLimiter:
+    """
+    Global daily generation limit backed by SQLite.
+    Holds a single WAL-mode connection and charges with one atomic
+    UPSERT-with-check statement, so concurrent sessions cannot overshoot.
+    Counts may be fractional so cheaper work (e.g. drafts) can weigh less.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_generations=MAX_GENERATIONS):
+        self.db_path = db_path
+        self.max_generations = max_generations
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._cached = None  # (date, used, fetched_at)
+
+    def _connect(self):
+        """Open the shared connection and set up the schema once per process"""
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_limits
+                (date TEXT PRIMARY KEY, count INTEGER)
+            """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS charges
+                (id TEXT PRIMARY KEY, date TEXT, count INTEGER)
+            """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS charges_date ON charges (date)")
+            self._conn = conn
+        return self._conn
+
+    def _read_used(self, conn, today):
+        row = conn.execute(
+            "SELECT count FROM daily_limits WHERE date = ?", (today,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _charge(self, conn, today, count):
+        """Atomic UPSERT-with-check; returns the new count or None if over the limit"""
+        if count > self.max_generations:
+            return None
+
+        rows = conn.execute(
+            """
+            INSERT INTO daily_limits (date, count) VALUES (?, ?)
+            ON CONFLICT(date) DO UPDATE SET count = count + excluded.count
+            WHERE count + excluded.count <= ?
+            RETURNING count
+        """,
+            (today, count, self.max_generations),
+        ).fetchall()
+
+        return rows[0][0] if rows else None
+
+    def _charge_once(self, conn, today, count, charge_id):
+        """
+        Charge at most once per charge_id, recording the charge in the same
+        transaction. Returns the new count, or None if over the limit.
+        """
+        # Yesterday's charges are kept so a job retried across midnight is
+        # still recognized; older ones can no longer matter
+        yesterday = (
+            datetime.fromisoformat(today) - timedelta(days=1)
+        ).date().isoformat()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM charges WHERE date < ?", (yesterday,))
+            already_charged = conn.execute(
+                "SELECT 1 FROM charges WHERE id = ?", (charge_id,)
+            ).fetchone()
+
+            if already_charged:
+                used = self._read_used(conn, today)
+            else:
+                used = self._charge(conn, today, count)
+                if used is not None:
+                    conn.execute(
+                        "INSERT INTO charges VALUES (?, ?, ?)",
+                        (charge_id, today, count),
+                    )
+
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return used
+
+    def check(self, count=1, charge_id=None):
+        """
+        Charge count generations if they fit under today's limit.
+        With a charge_id (e.g. a job ID) repeated calls only charge once.
+        Returns: (allowed, used, max_generations)
+        """
+        today = datetime.now().date().isoformat()
+
+        with self._lock:
+            conn = self._connect()
+
+            if charge_id is None:
+                used = self._charge(conn, today, count)
+            else:
+                used = self._charge_once(conn, today, count, charge_id)
+
+            if used is not None:
+                allowed = True
+            else:
+                used = self._read_used(conn, today)
+                allowed = False
+
+            self._cached = (today, used, time.monotonic())
+
+        return allowed, used, self.max_generations
+
+    def refund(self, charge_id):
+        """
+        Give back a charge made with check(charge_id=...), e.g. for work that
+        failed upstream. Returns: True if there was such a charge
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT date, count FROM charges WHERE id = ?", (charge_id,)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE daily_limits SET count = MAX(0, count - ?) WHERE date = ?",
+                        (row[1], row[0]),
+                    )
+                    conn.execute("DELETE FROM charges WHERE id = ?", (charge_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            # The next remaining() re-reads the count
+            self._cached = None
+
+        return row is not None
+
+    def remaining(self):
+        """
+        Remaining generations for display, served from memory when fresh.
+        Returns: (remaining, used, max_generations)
+        """
+        today = datetime.now().date().isoformat()
+
+        with self._lock:
+            cached = self._cached
+            if (
+                cached
+                and cached[0] == today
+                and time.monotonic() - cached[2] < REMAINING_CACHE_SECONDS
+            ):
+                used = cached[1]
+            else:
+                used = self._read_used(self._connect(), today)
+                self._cached = (today, used, time.monotonic())
+
+        return self.max_generations - used, used, self.max_generations
+
+
+class UserQuotas:
+    """
+    Per-client token buckets keyed on session or IP. Each client holds up to
+    capacity generations, refilled continuously over window seconds, so one
+    heavy user runs out of their own quota before the global daily limit.
+    Decisions are made in memory; changed buckets are written back to SQLite
+    in batches by a background thread and reloaded on startup, together with
+    the charge IDs already taken, so a job resumed after a restart is not
+    charged again. Processes
+    share buckets only through that write-back, so a client spread across
+    several of them can briefly get more; the global limit still caps the total.
+    """
+
+    def __init__(
+        self,
+        db_path=DB_PATH,
+        capacity=USER_GENERATION_QUOTA,
+        window=USER_QUOTA_WINDOW_SECONDS,
+        flush_seconds=QUOTA_FLUSH_SECONDS,
+    ):
+        self.db_path = db_path
+        self.capacity = capacity
+        self.window = window
+        self.flush_seconds = flush_seconds
+
+        self._lock = threading.Lock()
+        self._buckets = None  # client_id -> (tokens, updated_at), loaded lazily
+        self._dirty = set()
+        self._charges = OrderedDict()  # charge_id -> (client_id, count, charged_at)
+        self._charges_changed = {}  # charge_id -> row to write, or None to delete
+        self._flusher = None
+
+        # The load and the flushes share one connection, opened on first use
+        self._db_lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        """Open the shared connection and set up the schema once per process"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_quotas
+                (client_id TEXT PRIMARY KEY, tokens REAL, updated_at REAL)
+            """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_charges
+                (id TEXT PRIMARY KEY, client_id TEXT, count REAL, charged_at REAL)
+            """
+            )
+            self._conn = conn
+        return self._conn
+
+    def _load(self):
+        # Called with the lock held; buckets older than a window are full again
+        if self._buckets is None:
+            self._buckets = {}
+            try:
+                since = time.time() - self.window
+                with self._db_lock:
+                    conn = self._connect()
+                    rows = conn.execute(
+                        "SELECT client_id, tokens, updated_at FROM user_quotas "
+                        "WHERE updated_at > ?",
+                        (since,),
+                    ).fetchall()
+                    charges = conn.execute(
+                        "SELECT id, client_id, count, charged_at FROM user_charges "
+                        "WHERE charged_at > ? ORDER BY charged_at DESC LIMIT ?",
+                        (since, MAX_REMEMBERED_CHARGES),
+                    ).fetchall()
+                self._buckets = {row[0]: (row[1], row[2]) for row in rows}
+                for charge_id, *charge in reversed(charges):
+                    self._charges[charge_id] = tuple(charge)
+            except sqlite3.Error as e:
+                print(f"Error loading user quotas: {e}")
+
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="quota-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def _wait(self, tokens, count):
+        if tokens >= count:
+            return 0
+        if count > self.capacity:
+            return None
+        return (count - tokens) * self.window / self.capacity
+
+    def _tokens(self, client_id, now):
+        tokens, updated_at = self._buckets.get(client_id, (self.capacity, now))
+        refilled = (now - updated_at) * self.capacity / self.window
+        return min(self.capacity, tokens + refilled)
+
+    def take(self, client_id, count=1, charge_id=None):
+        """
+        Take count generations from a client's bucket if it holds them.
+        With a charge_id (e.g. a job ID) repeated calls only take once.
+        Returns: (allowed, retry_after) where retry_after is the seconds until
+        the bucket holds count again, or None if count exceeds the capacity
+        """
+        now = time.time()
+
+        with self._lock:
+            self._load()
+
+            if charge_id is not None and charge_id in self._charges:
+                return True, 0
+
+            tokens = self._tokens(client_id, now)
+            if tokens < count:
+                incr("rate_limit.user_denied")
+                return False, self._wait(tokens, count)
+
+            self._buckets[client_id] = (tokens - count, now)
+            self._dirty.add(client_id)
+
+            if charge_id is not None:
+                self._charges[charge_id] = (client_id, count, now)
+                self._charges_changed[charge_id] = (charge_id, client_id, count, now)
+                if len(self._charges) > MAX_REMEMBERED_CHARGES:
+                    self._charges.popitem(last=False)
+
+        return True, 0
+
+    def refund(self, client_id, count=1, charge_id=None):
+        """
+        Give back generations taken for work that did not happen. With a
+        charge_id, only if that charge was taken (and not refunded yet).
+        """
+        now = time.time()
+
+        with self._lock:
+            self._load()
+            if charge_id is not None:
+                if self._charges.pop(charge_id, None) is None:
+                    return
+                self._charges_changed[charge_id] = None
+            tokens = min(self.capacity, self._tokens(client_id, now) + count)
+            self._buckets[client_id] = (tokens, now)
+            self._dirty.add(client_id)
+
+    def remaining(self, client_id):
+        """
+        Generations the client can use right now.
+        Returns: (remaining, capacity)
+        """
+        with self._lock:
+            self._load()
+            return self._tokens(client_id, time.time()), self.capacity
+
+    def wait(self, client_id, count=1):
+        """
+        Seconds until the client's bucket holds count generations: 0 if it
+        already does, None if count exceeds the capacity.
+        """
+        with self._lock:
+            self._load()
+            return self._wait(self._tokens(client_id, time.time()), count)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        """
+        Write changed buckets and charge IDs in one transaction and forget
+        refilled buckets and charges older than a window
+        """
+        now = time.time()
+
+        with self._lock:
+            if self._buckets is None:
+                return
+            changed = [
+                (client_id, *self._buckets[client_id]) for client_id in self._dirty
+            ]
+            self._dirty = set()
+            charges, self._charges_changed = self._charges_changed, {}
+            # Full buckets are the default, so they need no memory or row
+            for client_id in list(self._buckets):
+                if self._tokens(client_id, now) >= self.capacity:
+                    del self._buckets[client_id]
+
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO user_quotas VALUES (?, ?, ?)", changed
+                    )
+                    conn.execute(
+                        "DELETE FROM user_quotas WHERE updated_at < ?",
+                        (now - self.window,),
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO user_charges VALUES (?, ?, ?, ?)",
+                        [row for row in charges.values() if row is not None],
+                    )
+                    conn.executemany(
+                        "DELETE FROM user_charges WHERE id = ?",
+                        [(charge_id,) for charge_id, row in charges.items() if row is None],
+                    )
+                    conn.execute(
+                        "DELETE FROM user_charges WHERE charged_at < ?",
+                        (now - self.window,),
+                    )
+        except sqlite3.Error as e:
+            print(f"Error flushing user quotas: {e}")
+
+
+rate_limiter = RateLimiter()
+user_quotas = UserQuotas()
+
+
+def check_rate_limit(count=1, charge_id=None):
+    """Check if user has exceeded daily rate limit, charging count generations"""
+    with timer("rate_limit.check"):
+        return rate_limiter.check(count, charge_id)
+
+
+def refund_rate_limit(charge_id):
+    """Undo check_rate_limit for a charge_id, e.g. when the work failed upstream"""
+    return rate_limiter.refund(charge_id)
+
+
+def get_remaining_generations():
+    """Get remaining generations for display"""
+    with timer("rate_limit.remaining"):
+        return rate_limiter.remaining()
+
+
+def check_user_quota(client_id, count=1, charge_id=None):
+    """
+    Charge count generations to one client's rolling quota, in memory.
+    Returns: (allowed, retry_after seconds, or None if count can never fit)
+    """
+    with timer("rate_limit.user_quota"):
+        return user_quotas.take(client_id, count, charge_id)
+
+
+def refund_user_quota(client_id, count=1, charge_id=None):
+    """Undo check_user_quota, e.g. when the global limit then refused"""
+    user_quotas.refund(client_id, count, charge_id)
+
+
+def get_user_remaining(client_id):
+    """Get a client's remaining generations for display: (remaining, capacity)"""
+    return user_quotas.remaining(client_id)
+
+
+def get_user_wait(client_id, count=1):
+    """Seconds before a client can spend count generations (0: now, None: never)"""
+    return user_quotas.wait(client_id, count)
+
+
+def user_quota_message(retry_after):
+    """Explain a per-client denial from check_user_quota"""
+    if retry_after is None:
+        return (
+            f"That is more than your quota of {user_quotas.capacity:g} "
+            "generations. Please pick fewer images."
+        )
+    minutes = max(1, round(retry_after / 60))
+    wait = f"{minutes} minutes" if minutes < 120 else f"{round(minutes / 60)} hours"
+    return (
+        f"You've used your {user_quotas.capacity:g} generations for now. "
+        f"More become available gradually; this one in about {wait}."
+    )
+
+
+# Stress test: python -m utils.rate_limit
+if __name__ == "__main__":
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    db_path = os.path.join(tempfile.mkdtemp(), "rate_limits.db")
+    # Several limiters means several connections racing inside SQLite too
+    limiters = [RateLimiter(db_path=db_path) for _ in range(4)]
+
+    def attempt(i):
+        allowed, used, max_count = limiters[i % 4].check(1 + i % 3)
+        assert used <= max_count, f"limit exceeded: {used}/{max_count}"
+        return allowed
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(attempt, range(2000)))
+
+    # A second limiter stands in for another session's connection
+    remaining, used, max_count = RateLimiter(db_path=db_path).remaining()
+
+    print(f"Allowed {sum(results)} of {len(results)} attempts, used {used}/{max_count}")
+    assert used <= max_count
+    assert used >= max_count - 1, "limit should be (nearly) exhausted"
+    print("✅ Limit was never exceeded")
+
+    # Per-client quotas decide in memory and persist in the background
+    quotas = UserQuotas(db_path=db_path, capacity=5, window=3600, flush_seconds=3600)
+    clients = [f"client-{i}" for i in range(1000)]
+    start = time.perf_counter()
+    allowed = sum(quotas.take(clients[i % 1000])[0] for i in range(100000))
+    per_decision = (time.perf_counter() - start) / 100000
+    print(f"Allowed {allowed} of 100000 quota decisions, {per_decision * 1e6:.1f}µs each")
+    assert allowed == 5 * len(clients), "each client should get exactly its quota"
+
+    quotas.flush()
+    reloaded = UserQuotas(db_path=db_path, capacity=5, window=3600)
+    assert not reloaded.take(clients[0])[0], "quota should survive a restart"
+
+    # A job resumed by another process is not charged again
+    quotas.take("resumed", 1, "job-1")
+    quotas.flush()
+    reloaded = UserQuotas(db_path=db_path, capacity=5, window=3600)
+    reloaded.take("resumed", 1, "job-1")
+    assert reloaded.remaining("resumed")[0] < 4.01, "charge ID should survive a restart"
+    print("✅ Per-client quotas and their charge IDs were reloaded from SQLite")
@@ -0,0 +1,306 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+from utils.paths import DATA_DIR
+from utils.cache import normalize_prompt
+
+SIMILARITY_DB_PATH = os.path.join(DATA_DIR, "similarity_index.db")
+
+# Similarity (see similarity()) needed to reuse suggestions; "dog in snow" vs
+# "a dog playing in the snow" scores 0.82, "cat chasing a dog" vs "dog chasing
+# a cat" and "woman not smiling" vs "woman smiling" 0.5. Set above 1 to disable.
+SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", 0.8))
+
+# Words that do not change what an image prompt is about
+STOPWORDS = frozenset(
+    "a an the of in on at to and or with by for from into onto over under "
+    "is are its it this that some very".split()
+)
+# Folded into the next content word, so "not smiling" is the token "!smiling"
+NEGATORS = frozenset("no not without never".split())
+
+# Word pairs are taken between content words at most this far apart
+PAIR_WINDOW = 2
+
+# Bump when prompt_tokens changes, so entries indexed the old way are dropped
+TOKENS_VERSION = "3"
+
+
+def prompt_tokens(text):
+    """
+    Content words of a prompt, lowercased and with simple plurals folded and
+    negations marked ("!smiling"), plus ordered pairs of nearby content words
+    ("cat>chasing"). "dogs in the snow" and "dog in snow" share every token;
+    "cat chasing a dog" and "dog chasing a cat" only share their words.
+    """
+    words = []
+    negated = False
+    for word in normalize_prompt(text).split():
+        if word in NEGATORS:
+            negated = True
+            continue
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(f"!{word}" if negated else word)
+        negated = False
+
+    pairs = [
+        f"{first}>{second}"
+        for i, first in enumerate(words)
+        for second in words[i + 1 : i + 1 + PAIR_WINDOW]
+    ]
+    return frozenset(words + pairs)
+
+
+def prompt_words(tokens):
+    """The single-word tokens of a prompt_tokens set"""
+    return frozenset(token for token in tokens if ">" not in token)
+
+
+def cosine(a, b):
+    """Cosine similarity of two token sets"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / math.sqrt(len(a) * len(b))
+
+
+def similarity(a, b):
+    """
+    Cosine similarity of two prompt_tokens sets' words, scaled down by how
+    much the prompts disagree on word order: half of it is kept only as far
+    as the word pairs both prompts could have (both words shared) agree.
+    Never more than the words' cosine, so "dog in snow" vs "a dog playing in
+    the snow" still scores 0.82 but "cat chasing a dog" vs "dog chasing a
+    cat" only 0.5.
+    """
+    words_a, words_b = prompt_words(a), prompt_words(b)
+    pairs_a = {t for t in a - words_a if set(t.split(">")) <= words_b}
+    pairs_b = {t for t in b - words_b if set(t.split(">")) <= words_a}
+    order = cosine(pairs_a, pairs_b) if pairs_a or pairs_b else 1.0
+    return cosine(words_a, words_b) * (1 + order) / 2
+
+
+def token_bit(token):
+    return hash(token) & 63
+
+
+def signature(tokens):
+    """64-bit set of hashed token bits, a compact superset filter for a token set"""
+    bits = 0
+    for token in tokens:
+        bits |= 1 << token_bit(token)
+    return bits
+
+
+class _IntArray:
+    """Append-only numpy integer array with amortized O(1) appends"""
+
+    def __init__(self, dtype, capacity=4):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._size = 0
+
+    def append(self, value):
+        if self._size == len(self._data):
+            self._data = np.resize(self._data, 2 * len(self._data))
+        self._data[self._size] = value
+        self._size += 1
+
+    def view(self):
+        return self._data[: self._size]
+
+    def __len__(self):
+        return self._size
+
+
+class SimilarityIndex:
+    """
+    Approximate-match index from past prompts to their analyze_prompt
+    suggestions, persisted in SQLite and held in memory as an inverted index
+    of their words.
+
+    similarity() never exceeds the cosine of the word sets, so a query with
+    q words only matches entries sharing at least ceil(threshold^2 * q) of
+    them, and candidates come from the postings of its rarest few words
+    alone. Candidates are then filtered in NumPy with an upper bound on the
+    cosine from 64-bit word signatures before the exact check.
+    """
+
+    def __init__(
+        self, db_path=SIMILARITY_DB_PATH, threshold=SIMILARITY_THRESHOLD, version=""
+    ):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.version = f"{version}/{TOKENS_VERSION}"
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._loaded = False
+
+        self._keys = []  # entry id -> normalized prompt
+        self._tokens = []  # entry id -> frozenset of tokens
+        self._ids = {}  # normalized prompt -> entry id
+        self._sizes = _IntArray(np.int32, 1024)  # entry id -> number of words
+        self._signatures = _IntArray(np.uint64, 1024)  # entry id -> word bits
+        self._postings = {}  # word -> _IntArray of entry ids
+
+    def _connect(self):
+        """Open the shared connection and create the table on first use"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS similarity_index
+                (key TEXT PRIMARY KEY, version TEXT, tokens TEXT, value TEXT,
+                 created_at REAL)
+            """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load(self):
+        """Build the in-memory index from disk once, dropping other versions"""
+        if self._loaded:
+            return
+        conn = self._connect()
+        conn.execute("DELETE FROM similarity_index WHERE version != ?", (self.version,))
+        conn.commit()
+        for key, tokens in conn.execute("SELECT key, tokens FROM similarity_index"):
+            self._insert(key, frozenset(tokens.split()))
+        self._loaded = True
+
+    def _insert(self, key, tokens):
+        if key in self._ids or not tokens:
+            return
+        words = prompt_words(tokens)
+        entry_id = len(self._keys)
+        self._keys.append(key)
+        self._tokens.append(tokens)
+        self._ids[key] = entry_id
+        self._sizes.append(len(words))
+        self._signatures.append(signature(words))
+        for token in words:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = _IntArray(np.int32)
+            postings.append(entry_id)
+
+    def _frequency(self, token):
+        postings = self._postings.get(token)
+        return 0 if postings is None else len(postings)
+
+    def _best_match(self, query):
+        """
+        Returns: (entry id, similarity) of the closest entry at or above the
+        threshold, or (None, 0.0)
+        """
+        # Entries sharing s of the query's q words have cosine <= s / sqrt(q * d)
+        words = prompt_words(query)
+        size = len(words)
+        min_shared = max(1, math.ceil(self.threshold**2 * size - 1e-9))
+        if min_shared > size:
+            return None, 0.0
+
+        # Anything missing all of the rarest q - min_shared + 1 words shares too few
+        rarest = sorted(words, key=self._frequency)
+        postings = [
+            self._postings[t].view()
+            for t in rarest[: size - min_shared + 1]
+            if t in self._postings
+        ]
+        if not postings:
+            return None, 0.0
+        candidates = np.concatenate(postings)
+
+        # Upper bound on shared words: query words whose bit is missing from an
+        # entry's signature are certainly not in it
+        sizes = self._sizes.view()[candidates]
+        common = self._signatures.view()[candidates] & np.uint64(signature(words))
+        shared = np.zeros(len(candidates), dtype=np.int32)
+        for token in words:
+            shared += (common & np.uint64(1 << token_bit(token))) != 0
+        keep = shared * shared >= self.threshold**2 * size * sizes - 1e-9
+
+        best_id, best_score = None, 0.0
+        for entry_id in set(candidates[keep].tolist()):
+            score = similarity(query, self._tokens[entry_id])
+            if score > best_score:
+                best_id, best_score = entry_id, score
+
+        if best_score >= self.threshold:
+            return best_id, best_score
+        return None, 0.0
+
+    def load(self):
+        """Build the in-memory index now rather than on the first lookup"""
+        with self._lock:
+            try:
+                self._load()
+            except sqlite3.Error as e:
+                print(f"Error loading similarity index: {e}")
+
+    def lookup(self, prompt):
+        """
+        Find suggestions stored for a prompt similar enough to this one.
+        Returns: (suggestions, matched_prompt, similarity) or (None, None, 0.0)
+        """
+        query = prompt_tokens(prompt)
+        if not query or self.threshold > 1:
+            return None, None, 0.0
+
+        with self._lock:
+            try:
+                self._load()
+                entry_id, score = self._best_match(query)
+                if entry_id is None:
+                    return None, None, 0.0
+
+                key = self._keys[entry_id]
+                row = self._conn.execute(
+                    "SELECT value FROM similarity_index WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None, None, 0.0
+                return json.loads(row[0]), key, score
+            except sqlite3.Error as e:
+                print(f"Error reading similarity index: {e}")
+                return None, None, 0.0
+
+    def add(self, prompt, suggestions):
+        """Index a prompt's suggestions, on disk and in memory"""
+        key = normalize_prompt(prompt)
+        tokens = prompt_tokens(prompt)
+        if not tokens:
+            return
+
+        with self._lock:
+            try:
+                self._load()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO similarity_index VALUES (?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        self.version,
+                        " ".join(sorted(tokens)),
+                        json.dumps(suggestions),
+                        time.time(),
+                    ),
+                )
+                self._conn.commit()
+                self._insert(key, tokens)
+            except sqlite3.Error as e:
+                print(f"Error writing similarity index: {e}")
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._keys)
@@ -0,0 +1,112 @@
+import asyncio
+
+from utils.metrics import incr
+
+
+class _StreamFlight:
+    """Items produced by one in-flight stream, replayable by any number of readers"""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def push(self, item):
+        async with self.changed:
+            self.items.append(item)
+            self.changed.notify_all()
+
+    async def close(self, error=None):
+        async with self.changed:
+            self.done = True
+            self.error = error
+            self.changed.notify_all()
+
+    async def replay(self):
+        index = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(
+                    lambda: index < len(self.items) or self.done
+                )
+                new_items = self.items[index:]
+                finished = self.done and index + len(new_items) == len(self.items)
+                error = self.error
+
+            for item in new_items:
+                yield item
+            index += len(new_items)
+
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call whose
+    result every caller shares. Must be used from coroutines on a single
+    event loop (the shared upstream loop).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> Future of the leader's result
+        self._streams = {}  # key -> _StreamFlight
+
+    async def do(self, key, coro_fn):
+        """
+        Await coro_fn() unless a call with this key is already in flight,
+        in which case wait for and share its result.
+        Returns: (result, shared) where shared is True for waiters
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            incr(f"singleflight.{self.name}.shared")
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        # Mark the exception as retrieved in case nobody else was waiting
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+    async def stream(self, key, agen_fn):
+        """
+        Async generator over agen_fn()'s items, shared by every concurrent
+        caller with the same key. The producer runs as its own task, so it
+        finishes even if the caller that started it stops reading.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            asyncio.ensure_future(self._produce(key, flight, agen_fn))
+        else:
+            incr(f"singleflight.{self.name}.shared")
+
+        async for item in flight.replay():
+            yield item
+
+    async def _produce(self, key, flight, agen_fn):
+        error = None
+        try:
+            async for item in agen_fn():
+                await flight.push(item)
+        except Exception as e:
+            error = e
+        finally:
+            del self._streams[key]
+            await flight.close(error)
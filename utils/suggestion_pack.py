@@ -0,0 +1,255 @@
+import os
+import json
+import mmap
+import time
+import struct
+import asyncio
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+
+from utils.paths import ASSETS_DIR
+from utils.cache import normalize_prompt
+
+# Shipped with the app so a cold start (e.g. on Spaces without persistent
+# storage) already knows the example and most common prompts
+SUGGESTION_PACK_PATH = os.environ.get(
+    "SUGGESTION_PACK_PATH", os.path.join(ASSETS_DIR, "suggestion_pack.bin")
+)
+
+# File layout: MAGIC, then FORMAT_VERSION and the JSON header's length, the
+# JSON header, an index sorted by prompt hash, and the entries' JSON
+MAGIC = b"SGPK"
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct("<4sII")
+INDEX_DTYPE = np.dtype([("hash", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+
+
+def prompt_hash(normalized):
+    return int.from_bytes(
+        hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+class SuggestionPack:
+    """
+    Read-only suggestions for a fixed set of prompts, memory-mapped from a
+    file built offline by `python -m utils.suggestion_pack`. Opening it only
+    reads the header; lookups binary search the mapped index and decode one
+    entry. A missing file, or one built for another prompt version, is empty.
+    """
+
+    def __init__(self, path=SUGGESTION_PACK_PATH, version=None):
+        self.path = path
+        self.version = version
+        self.header = {}
+
+        self._mmap = None
+        self._index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._data_start = 0
+
+        try:
+            self._open()
+        except (OSError, ValueError) as e:
+            print(f"Error loading suggestion pack {path}: {e}")
+
+    def _open(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, format_version, header_length = PREAMBLE.unpack_from(data)
+            if magic != MAGIC or format_version != FORMAT_VERSION:
+                raise ValueError("not a suggestion pack of a supported format")
+
+            header_start = PREAMBLE.size
+            header = json.loads(data[header_start : header_start + header_length])
+            if self.version is not None and header["version"] != self.version:
+                # Built for other prompts or another model; its suggestions would be stale
+                print(f"Ignoring suggestion pack built for version {header['version']}")
+                data.close()
+                return
+
+            index_start = header_start + header_length
+            index = np.frombuffer(
+                data, dtype=INDEX_DTYPE, count=header["count"], offset=index_start
+            )
+        except BaseException:
+            data.close()
+            raise
+
+        self._index = index
+        self._data_start = index_start + index.nbytes
+        self._mmap = data
+        self.header = header
+
+    def _entry(self, position):
+        offset = self._data_start + int(self._index["offset"][position])
+        length = int(self._index["length"][position])
+        return json.loads(self._mmap[offset : offset + length])
+
+    def get(self, user_prompt):
+        """
+        Look up a prompt's packed suggestions.
+        Returns: a fresh suggestions dict, or None if the prompt is not packed
+        """
+        normalized = normalize_prompt(user_prompt)
+        target = prompt_hash(normalized)
+        hashes = self._index["hash"]
+
+        position = int(np.searchsorted(hashes, target))
+        while position < len(hashes) and hashes[position] == target:
+            entry = self._entry(position)
+            if entry["prompt"] == normalized:
+                return entry["suggestions"]
+            position += 1
+        return None
+
+    def items(self):
+        """Every (normalized prompt, suggestions) pair in the pack"""
+        for position in range(len(self)):
+            entry = self._entry(position)
+            yield entry["prompt"], entry["suggestions"]
+
+    def __len__(self):
+        return len(self._index)
+
+
+def write_pack(path, entries, version):
+    """
+    Write {normalized prompt: suggestions} as a pack, replacing the file
+    atomically so running processes keep their mapping of the old one.
+    Returns: the pack's size in bytes
+    """
+    blobs = sorted(
+        (
+            prompt_hash(prompt),
+            json.dumps(
+                {"prompt": prompt, "suggestions": suggestions},
+                separators=(",", ":"),
+                ensure_ascii=False,
+            ).encode("utf-8"),
+        )
+        for prompt, suggestions in entries.items()
+    )
+
+    index = np.zeros(len(blobs), dtype=INDEX_DTYPE)
+    offset = 0
+    for i, (hash_value, blob) in enumerate(blobs):
+        index[i] = (hash_value, offset, len(blob))
+        offset += len(blob)
+
+    header = json.dumps(
+        {"version": version, "count": len(blobs), "built_at": time.time()}
+    ).encode("utf-8")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(index.tobytes())
+        for hash_value, blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+    return os.path.getsize(path)
+
+
+async def analyze_all(prompts, concurrency):
+    """
+    Analyze prompts upstream with at most concurrency in flight.
+    Returns: {normalized prompt: suggestions} for those that succeeded
+    """
+    from utils.llm import analyze_prompt_upstream_async
+
+    slots = asyncio.Semaphore(concurrency)
+    results = {}
+
+    async def analyze(prompt):
+        async with slots:
+            suggestions = await analyze_prompt_upstream_async(prompt)
+        if suggestions:
+            results[normalize_prompt(prompt)] = suggestions
+        print(f"  {'✅' if suggestions else '❌'} {prompt}")
+
+    await asyncio.gather(*(analyze(prompt) for prompt in prompts))
+    return results
+
+
+# Offline build: python -m utils.suggestion_pack [--prompts trending.txt]
+if __name__ == "__main__":
+    from utils.aio import run_sync
+    from utils.cache import suggestion_cache
+    from utils.llm import PROMPT_VERSION, EXAMPLE_PROMPTS
+
+    parser = argparse.ArgumentParser(
+        description="Build or refresh the suggestion pack loaded at startup"
+    )
+    parser.add_argument(
+        "--prompts",
+        action="append",
+        default=[],
+        help="text file of curated or trending prompts, one per line",
+    )
+    parser.add_argument(
+        "--recent",
+        type=int,
+        default=200,
+        help="also pack this many most recently used prompts from the suggestion cache",
+    )
+    parser.add_argument("--max-entries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--output", default=SUGGESTION_PACK_PATH)
+    parser.add_argument(
+        "--rebuild", action="store_true", help="re-analyze prompts already in the pack"
+    )
+    args = parser.parse_args()
+
+    curated = list(EXAMPLE_PROMPTS)
+    for path in args.prompts:
+        with open(path, encoding="utf-8") as f:
+            curated += [line.strip() for line in f if line.strip()]
+
+    # Step 1: keep what the current pack already has (same version only)
+    previous = {}
+    if not args.rebuild:
+        previous = dict(SuggestionPack(args.output, version=PROMPT_VERSION).items())
+
+    # Step 2: observed traffic, already analyzed, so it costs no upstream calls
+    recent = {}
+    for key, suggestions in suggestion_cache.recent(f"{PROMPT_VERSION}:", args.recent):
+        recent[key.split(":", 1)[1]] = suggestions
+
+    # Step 3: analyze curated prompts the pack and cache do not cover yet
+    missing = []
+    for prompt in curated:
+        normalized = normalize_prompt(prompt)
+        if normalized not in previous and normalized not in recent:
+            missing.append(prompt)
+    print(f"Analyzing {len(missing)} new prompts...")
+    analyzed = run_sync(analyze_all(missing, args.concurrency))
+
+    # Curated prompts always make it in; traffic, then older entries fill the rest
+    curated_keys = {normalize_prompt(prompt) for prompt in curated}
+    entries = {}
+    for source in (analyzed, recent, previous):
+        for prompt in curated_keys & source.keys():
+            entries.setdefault(prompt, source[prompt])
+    for source in (recent, previous):
+        for prompt, suggestions in source.items():
+            if len(entries) >= args.max_entries:
+                break
+            entries.setdefault(prompt, suggestions)
+
+    size = write_pack(args.output, entries, PROMPT_VERSION)
+    print(
+        f"✅ Wrote {len(entries)} prompts ({len(analyzed)} analyzed, "
+        f"{len(missing) - len(analyzed)} failed) to {args.output}, {size / 1024:.1f} KB"
+    )